@@ -0,0 +1,89 @@
+"""Throughput of sequential vs. per-user concurrent update processing.
+
+Simulates a mixed load: most updates are quick menu taps, some are slow sends
+(download-all, document replies). Also checks that each user's updates still
+complete in arrival order under the concurrent processor.
+
+Usage: python benchmarks/bench_concurrent_updates.py [updates] [users] [concurrency]
+"""
+
+from __future__ import annotations
+
+import asyncio
+import datetime as dtm
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from telegram import Chat, Message, Update, User  # noqa: E402
+
+from utils.update_processor import PerUserUpdateProcessor  # noqa: E402
+
+FAST_S = 0.005  # menu tap: one cached lookup and an edit
+SLOW_S = 0.25  # document send / media group
+SLOW_SHARE = 0.1
+
+
+def _updates(n: int, users: int, seed: int = 7) -> list[tuple[Update, float]]:
+    rnd = random.Random(seed)
+    now = dtm.datetime.now(dtm.timezone.utc)
+    out = []
+    for i in range(n):
+        uid = rnd.randint(1, users)
+        msg = Message(i, now, Chat(uid, "private"), from_user=User(uid, "u", False), text="x")
+        cost = SLOW_S if rnd.random() < SLOW_SHARE else FAST_S
+        out.append((Update(i, message=msg), cost))
+    return out
+
+
+async def _handle(update: Update, cost: float, done: list[tuple[int, int]]) -> None:
+    await asyncio.sleep(cost)
+    done.append((update.effective_user.id, update.update_id))
+
+
+async def _sequential(load: list[tuple[Update, float]]) -> float:
+    done: list[tuple[int, int]] = []
+    start = time.perf_counter()
+    for update, cost in load:
+        await _handle(update, cost, done)
+    return time.perf_counter() - start
+
+
+async def _concurrent(load: list[tuple[Update, float]], concurrency: int) -> tuple[float, bool]:
+    done: list[tuple[int, int]] = []
+    processor = PerUserUpdateProcessor(concurrency)
+    start = time.perf_counter()
+    # Same shape as Application: one task per update, created in arrival order.
+    tasks = [
+        asyncio.create_task(processor.process_update(u, _handle(u, cost, done)))
+        for u, cost in load
+    ]
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    last: dict[int, int] = {}
+    ordered = True
+    for uid, update_id in done:
+        if update_id < last.get(uid, -1):
+            ordered = False
+        last[uid] = update_id
+    return elapsed, ordered
+
+
+async def main(n: int, users: int, concurrency: int) -> None:
+    load = _updates(n, users)
+    t_seq = await _sequential(load)
+    t_con, ordered = await _concurrent(load, concurrency)
+    print(f"updates={n} users={users} concurrency={concurrency} slow_share={SLOW_SHARE:.0%}")
+    print(f"sequential : {n / t_seq:8.1f} updates/s ({t_seq:.2f}s)")
+    print(f"per-user   : {n / t_con:8.1f} updates/s ({t_con:.2f}s)")
+    print(f"speedup    : {t_seq / t_con:8.1f}x")
+    print(f"per-user order preserved: {ordered}")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    n, users, conc = (args + [400, 50, 32][len(args):])[:3]
+    asyncio.run(main(n, users, conc))
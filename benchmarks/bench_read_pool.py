@@ -0,0 +1,124 @@
+"""Read latency while a bulk write runs: single connection vs. read pool.
+
+A batch upload (staged files promoted into lectures) and a subject wipe run on
+the writer. Meanwhile simulated users run the reads that still reach SQLite:
+lecture search and per-subject counters; one task keeps rebuilding the browse
+catalog snapshot. With the pool off every read waits behind the write on the one
+connection thread; with it on, reads run on their own connections.
+
+Usage: python benchmarks/bench_read_pool.py [bulk_rows] [browsers] [pool_size]
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_tmp = tempfile.mkdtemp(prefix="bench_pool_")
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ["DATABASE_PATH"] = str(Path(_tmp) / "bench.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db  # noqa: E402
+from services import catalog as catalog_svc  # noqa: E402
+from utils.arabic import normalize_arabic  # noqa: E402
+
+SUBJECTS = 20
+LECTURES_PER_SUBJECT = 200
+
+
+async def _upload(subject_id: int, titles: list[str]) -> None:
+    """The batch-upload path: stage all files in a session, then promote it."""
+    session_id = await db.create_upload_session(1, subject_id)
+    await db.stage_upload_files(
+        session_id,
+        [{"seq": i, "title": t, "file_id": f"{subject_id}_{i}"} for i, t in enumerate(titles)],
+    )
+    await db.promote_upload_session(session_id)
+
+
+async def _seed() -> list[int]:
+    subject_ids = []
+    for s in range(SUBJECTS):
+        _, sid = await db.add_subject(f"مادة {s}")
+        await _upload(sid, [f"محاضرة {i}" for i in range(LECTURES_PER_SUBJECT)])
+        subject_ids.append(sid)
+    return subject_ids
+
+
+async def _browser(n: int, subject_ids: list[int], stop: asyncio.Event, out: list[float]) -> None:
+    i = n
+    while not stop.is_set():
+        sid = subject_ids[i % len(subject_ids)]
+        start = time.perf_counter()
+        await db.search_lectures(normalize_arabic(f"محاضرة {i % LECTURES_PER_SUBJECT}"), 0, 5)
+        await db.count_lectures_in_subject(sid)
+        out.append(time.perf_counter() - start)
+        i += 1
+        await asyncio.sleep(0.002)
+
+
+async def _rebuilder(stop: asyncio.Event, out: list[float]) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await catalog_svc.reload()
+        out.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+
+
+async def _run(
+    pool_size: int, bulk_rows: int, browsers: int
+) -> tuple[list[float], list[float], float]:
+    db.DB_READ_POOL_SIZE = pool_size
+    await db.init_db()
+    try:
+        subject_ids = await _seed()
+        _, target = await db.add_subject("دفعة")
+        stop = asyncio.Event()
+        latencies: list[float] = []
+        rebuilds: list[float] = []
+        tasks = [
+            asyncio.create_task(_browser(n, subject_ids, stop, latencies))
+            for n in range(browsers)
+        ]
+        tasks.append(asyncio.create_task(_rebuilder(stop, rebuilds)))
+        await asyncio.sleep(0.05)
+        start = time.perf_counter()
+        await _upload(target, [f"ملف {i}" for i in range(bulk_rows)])
+        await db.delete_all_lectures_in_subject(target)
+        write_s = time.perf_counter() - start
+        stop.set()
+        await asyncio.gather(*tasks)
+        return latencies, rebuilds, write_s
+    finally:
+        await db.close_db()
+        for suffix in ("", "-wal", "-shm"):
+            Path(os.environ["DATABASE_PATH"] + suffix).unlink(missing_ok=True)
+
+
+def _pct(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+
+
+async def main(bulk_rows: int, browsers: int, pool_size: int) -> None:
+    print(f"bulk_rows={bulk_rows} browsers={browsers} pool_size={pool_size}")
+    for label, size in (("single connection", 0), ("read pool", pool_size)):
+        lat, rebuilds, write_s = await _run(size, bulk_rows, browsers)
+        print(
+            f"{label:17}: {len(lat):5d} reads, p50 {_pct(lat, 0.5):7.1f} ms, "
+            f"p99 {_pct(lat, 0.99):7.1f} ms, max {max(lat) * 1000:7.1f} ms; "
+            f"{len(rebuilds)} catalog rebuilds, p99 {_pct(rebuilds, 0.99):7.1f} ms; "
+            f"bulk write {write_s:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    rows, browsers, size = (args + [30000, 8, 4][len(args):])[:3]
+    asyncio.run(main(rows, browsers, size))
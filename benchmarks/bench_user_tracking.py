@@ -0,0 +1,62 @@
+"""Compare user-tracking throughput: per-update upsert vs. write-behind buffer.
+
+Usage: python benchmarks/bench_user_tracking.py [updates] [distinct_users]
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_tmp = tempfile.mkdtemp(prefix="bench_users_")
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ["DATABASE_PATH"] = str(Path(_tmp) / "bench.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db  # noqa: E402
+from services import activity as activity_svc  # noqa: E402
+
+
+async def _direct(user_ids: list[int]) -> float:
+    start = time.perf_counter()
+    for uid in user_ids:
+        # Old path: track_user was called twice per update.
+        await db.upsert_user(uid, f"u{uid}", "name")
+        await db.upsert_user(uid, f"u{uid}", "name")
+    return time.perf_counter() - start
+
+
+async def _buffered(user_ids: list[int]) -> float:
+    start = time.perf_counter()
+    for uid in user_ids:
+        await activity_svc.record(uid, f"u{uid}", "name")
+        await activity_svc.record(uid, f"u{uid}", "name")
+    await activity_svc.flush()
+    return time.perf_counter() - start
+
+
+async def main(updates: int, distinct: int) -> None:
+    await db.init_db()
+    rnd = random.Random(42)
+    user_ids = [rnd.randint(1_000, 1_000 + distinct) for _ in range(updates)]
+    try:
+        t_direct = await _direct(user_ids)
+        t_buffered = await _buffered(user_ids)
+    finally:
+        await db.close_db()
+    print(f"updates={updates} distinct_users={distinct}")
+    print(f"direct upsert : {updates / t_direct:10.0f} updates/s ({t_direct:.3f}s)")
+    print(f"write-behind  : {updates / t_buffered:10.0f} updates/s ({t_buffered:.3f}s)")
+    print(f"speedup       : {t_direct / t_buffered:10.1f}x")
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    d = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    asyncio.run(main(n, d))
@@ -1,16 +1,43 @@
-"""Telegram Lectures Bot — entry point (polling)."""
+"""Telegram Lectures Bot — entry point (polling or webhook)."""
 
 from __future__ import annotations
 
 import logging
 
-from telegram.ext import Application, CallbackQueryHandler, CommandHandler, MessageHandler, filters
+from telegram import Update
+from telegram.ext import (
+    Application,
+    CallbackQueryHandler,
+    ChatMemberHandler,
+    CommandHandler,
+    MessageHandler,
+    TypeHandler,
+    filters,
+)
 
-from config import BOT_TOKEN, LOG_LEVEL
+from config import (
+    BACKUP_INTERVAL_S,
+    BOT_MODE,
+    BOT_TOKEN,
+    CONCURRENT_UPDATES,
+    LOG_LEVEL,
+    REACHABILITY_REPORT_INTERVAL_S,
+    STARTUP_BACKLOG,
+    USER_ACTIVITY_FLUSH_INTERVAL_S,
+)
 from db import close_db, init_db
 from handlers import admin as admin_handlers
 from handlers import user as user_handlers
-from handlers.common import error_handler
+from handlers.common import error_handler, report_request_stats, resolve_request_state
+from services import activity as activity_svc
+from services import backup as backup_svc
+from services import backlog as backlog_svc
+from services import broadcast as broadcast_svc
+from services import catalog as catalog_svc
+from services import download as download_svc
+from services import outbox as outbox_svc
+from services import upload as upload_svc
+from utils.update_processor import PerUserUpdateProcessor
 
 logging.basicConfig(
     format="%(asctime)s %(levelname)s %(name)s: %(message)s",
@@ -22,28 +49,79 @@ logger = logging.getLogger(__name__)
 async def post_init(application: Application) -> None:
     await init_db()
     logger.info("Database ready.")
+    cat = await catalog_svc.reload()
+    logger.info(
+        "Catalog loaded: %d subjects, %d lectures.",
+        len(cat.subjects),
+        len(cat.lectures_by_id),
+    )
+    application.job_queue.run_repeating(
+        activity_svc.flush_job,
+        interval=USER_ACTIVITY_FLUSH_INTERVAL_S,
+        first=USER_ACTIVITY_FLUSH_INTERVAL_S,
+        name="user_activity_flush",
+    )
+    application.job_queue.run_repeating(
+        broadcast_svc.reachability_report_job,
+        interval=REACHABILITY_REPORT_INTERVAL_S,
+        first=REACHABILITY_REPORT_INTERVAL_S,
+        name="reachability_report",
+    )
+    if BACKUP_INTERVAL_S > 0:
+        application.job_queue.run_repeating(
+            backup_svc.backup_job,
+            interval=BACKUP_INTERVAL_S,
+            first=BACKUP_INTERVAL_S,
+            name="scheduled_backup",
+        )
+    resumed = await broadcast_svc.resume_pending(application.bot)
+    if resumed:
+        logger.info("Resumed %d unfinished broadcast(s).", resumed)
+    if BOT_MODE == "polling" and STARTUP_BACKLOG == "process":
+        await backlog_svc.drain(application)
 
 
 async def post_shutdown(application: Application) -> None:
+    await broadcast_svc.stop_all()
+    await download_svc.stop_all()
+    try:
+        await upload_svc.shutdown()
+    except Exception:
+        # Files staged earlier are kept; the activity flush and close_db must still run.
+        logger.exception("Could not stage pending upload files at shutdown")
+    flushed = await activity_svc.flush()
+    logger.info("Flushed %d pending user records.", flushed)
     await close_db()
     logger.info("Database closed.")
 
 
 def main() -> None:
-    application = (
+    builder = (
         Application.builder()
         .token(BOT_TOKEN)
+        .rate_limiter(outbox_svc.get_limiter())
         .post_init(post_init)
         .post_shutdown(post_shutdown)
-        .build()
     )
+    if CONCURRENT_UPDATES > 1:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+    application = builder.build()
 
     application.add_error_handler(error_handler)
 
+    # Runs before every other group: track the user and resolve admin/running once.
+    application.add_handler(TypeHandler(Update, resolve_request_state), group=-1)
+
     application.add_handler(CommandHandler("start", user_handlers.cmd_start), group=0)
     application.add_handler(CommandHandler("help", user_handlers.cmd_help), group=0)
     application.add_handler(CommandHandler("subjects", user_handlers.cmd_subjects), group=0)
     application.add_handler(CommandHandler("admin", user_handlers.cmd_admin), group=0)
+    application.add_handler(CommandHandler("recount", admin_handlers.cmd_recount), group=0)
+    application.add_handler(CommandHandler("backups", admin_handlers.cmd_backups), group=0)
+    application.add_handler(
+        ChatMemberHandler(user_handlers.on_my_chat_member, ChatMemberHandler.MY_CHAT_MEMBER),
+        group=0,
+    )
 
     application.add_handler(user_handlers.build_user_conversation(), group=1)
 
@@ -79,8 +157,18 @@ def main() -> None:
     )
     application.add_handler(CallbackQueryHandler(admin_handlers.admin_callback_router), group=5)
 
+    application.add_handler(TypeHandler(Update, report_request_stats), group=99)
+
+    if BOT_MODE == "webhook":
+        from webhook import run_webhook
+
+        logger.info("Starting webhook server...")
+        run_webhook(application)
+        return
+
     logger.info("Starting polling...")
-    application.run_polling(drop_pending_updates=True)
+    # With STARTUP_BACKLOG=process, post_init has already drained and acknowledged it.
+    application.run_polling(drop_pending_updates=STARTUP_BACKLOG == "drop")
 
 
 if __name__ == "__main__":
@@ -26,8 +26,79 @@ ADMIN_DISPLAY_NAME = os.environ.get("ADMIN_DISPLAY_NAME", "Ahmed")
 PAGE_SIZE_SUBJECTS = 8
 PAGE_SIZE_LECTURES = 5
 PAGE_SIZE_SEARCH = 5
-# Batch upload progress update interval (messages)
-BATCH_UPLOAD_PROGRESS_EVERY = 3
+# Batch upload: minimum seconds between progress edits, and how long an album
+# (documents sharing a media_group_id) may stay quiet before it is staged
+BATCH_UPLOAD_PROGRESS_INTERVAL_S = 2.0
+ALBUM_DEBOUNCE_S = 1.0
+# Batch upload files buffered in memory before they are staged in the database
+UPLOAD_STAGE_FLUSH_EVERY = 10
+
+# Read-only SQLite connections for query-only functions (db.py); 0 sends every
+# query through the single writer connection.
+DB_READ_POOL_SIZE = int(os.environ.get("DB_READ_POOL_SIZE", "4"))
+
+# Background data migrations (db.py): rows per batch and pause between batches.
+MIGRATION_BATCH_SIZE = 500
+MIGRATION_BATCH_PAUSE_S = 0.05
+
+# User activity write-behind buffer (seconds / pending users before a forced flush)
+USER_ACTIVITY_FLUSH_INTERVAL_S = 5
+USER_ACTIVITY_FLUSH_MAX = 200
+
+# Outbound scheduler (services/outbox.py): global Bot API send rate (Telegram
+# allows ~30 msg/s), spacing of background sends to one chat, and RetryAfter
+# retries before the error reaches the caller.
+OUTBOX_RATE_PER_S = 25
+OUTBOX_PER_CHAT_INTERVAL_S = 1.0
+OUTBOX_MAX_RETRIES = 3
+
+# Broadcasts: parallel sends and how many users are processed between
+# progress checkpoints.
+BROADCAST_CONCURRENCY = 8
+BROADCAST_CHUNK_SIZE = 100
+
+# "Download all": documents per sendMediaGroup album (Telegram max 10).
+DOWNLOAD_BATCH_SIZE = 10
+
+# Users are skipped by broadcasts once they block the bot (Forbidden) or after
+# this many consecutive rejected sends; a reachability report goes to ADMIN_ID.
+USER_MAX_SEND_FAILURES = 3
+REACHABILITY_REPORT_INTERVAL_S = 24 * 60 * 60
+
+# Updates processed at the same time (each user's updates still run in order);
+# 1 keeps PTB's sequential processing.
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "32"))
+
+# Update delivery: "polling" (default) or "webhook" (embedded server, see webhook.py).
+# WEBHOOK_URL is the public base URL registered with Telegram; leave it empty to
+# serve without registering (local testing). Railway provides PORT. WEBHOOK_SECRET
+# is required: requests without it in X-Telegram-Bot-Api-Secret-Token are refused.
+BOT_MODE = os.environ.get("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").strip()
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", os.environ.get("PORT", "8080")))
+WEBHOOK_PATH = "/" + os.environ.get("WEBHOOK_PATH", "telegram").strip().strip("/")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "").strip()
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    # Without it anyone who finds the URL can post updates, e.g. as ADMIN_ID.
+    raise RuntimeError("WEBHOOK_SECRET is not set. It is required when BOT_MODE=webhook.")
+
+# Updates that arrived while the bot was down (polling mode): "process" drains
+# them at startup (stale callback presses deduplicated), "drop" discards them.
+STARTUP_BACKLOG = os.environ.get("STARTUP_BACKLOG", "process").strip().lower()
+
+# Backups (services/backup.py): gzip archives above this size are sent in parts
+# (Telegram bots may upload documents up to 50 MB).
+BACKUP_PART_BYTES = 45 * 1024 * 1024
+
+# Scheduled backups: a verified snapshot every BACKUP_INTERVAL_S (0 = off) into
+# BACKUP_DIR (next to the database by default, i.e. on the same volume). One
+# per hour is kept for BACKUP_KEEP_HOURLY_H hours, one per day for
+# BACKUP_KEEP_DAILY_D days.
+BACKUP_DIR = os.environ.get("BACKUP_DIR", str(Path(DATABASE_PATH).resolve().parent / "backups"))
+BACKUP_INTERVAL_S = int(os.environ.get("BACKUP_INTERVAL_S", str(60 * 60)))
+BACKUP_KEEP_HOURLY_H = 24
+BACKUP_KEEP_DAILY_D = 30
 
 # Logging
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
@@ -1,36 +1,348 @@
-"""Async SQLite data access (aiosqlite)."""
+"""Async SQLite data access (aiosqlite).
+
+One writer connection serves every write. Functions marked ``@_read_only`` run
+on a pool of ``DB_READ_POOL_SIZE`` read-only connections instead, so browsing
+is not queued behind a slow write on the writer's thread (WAL lets readers run
+alongside it). Readers see committed data only.
+
+Every function that writes is marked ``@_writes``: it holds the writer for its
+whole body, so its statements commit (or roll back) as one unit and no other
+task's commit can land between them.
+"""
 
 from __future__ import annotations
 
+import asyncio
+import functools
+import logging
+import math
+import os
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Any, Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, TypeVar
+from urllib.parse import quote
 
 import aiosqlite
 
-from config import ADMIN_ID, DATABASE_PATH
+from config import (
+    ADMIN_ID,
+    DATABASE_PATH,
+    DB_READ_POOL_SIZE,
+    MIGRATION_BATCH_PAUSE_S,
+    MIGRATION_BATCH_SIZE,
+)
+from utils.arabic import normalize_arabic
+
+logger = logging.getLogger(__name__)
 
 _connection: Optional[aiosqlite.Connection] = None
+# Idle read-only connections; None = no pool (reads use the writer).
+_readers: Optional[asyncio.Queue[aiosqlite.Connection]] = None
+_all_readers: list[aiosqlite.Connection] = []
+# Reader held by the current task inside a @_read_only call.
+_read_conn: ContextVar[Optional[aiosqlite.Connection]] = ContextVar("db_read_conn", default=None)
+# Cleared while replace_database() swaps the file; get_db() waits on it meanwhile
+# (except in the task doing the swap).
+_open_gate = asyncio.Event()
+_open_gate.set()
+_in_maintenance: ContextVar[bool] = ContextVar("db_in_maintenance", default=False)
+# Held by the task running a @_writes function (re-entrant for that task).
+_write_lock = asyncio.Lock()
+_write_owner: Optional[asyncio.Task] = None
+# @_read_only calls running on the writer (no pool) right now; replace_database waits for 0.
+_writer_reads = 0
+# total_changes of connections closed earlier, so total_changes() never goes back.
+_changes_offset = 0
+_background_migrations: Optional[asyncio.Task] = None
+
+# Bumped by every subject/lecture/link mutation; read-side snapshots compare it.
+_catalog_version = 0
+
+# In-process copies of the settings table and the admin set. None = not loaded;
+# set_setting / add_admin / remove_admin keep them current once loaded.
+_settings_cache: Optional[dict[str, str]] = None
+_admin_ids_cache: Optional[frozenset[int]] = None
+_cache_hits = 0
+_cache_misses = 0
+
+
+class CallCounter:
+    """Number of get_db() calls (one per data-access function) in one update."""
+
+    __slots__ = ("count",)
+
+    def __init__(self) -> None:
+        self.count = 0
+
+
+_call_counter: ContextVar[Optional[CallCounter]] = ContextVar("db_call_counter", default=None)
+
+# The trigram tokenizer cannot match phrases shorter than three characters.
+_FTS_MIN_QUERY_LEN = 3
+
+
+@dataclass(frozen=True)
+class Page:
+    """One page of a paginated listing and the size of the whole listing.
+
+    Shared by the browse views (built by services.catalog from its snapshot)
+    and search (search_lectures, rows and total in one statement).
+    """
+
+    rows: list[dict[str, Any]]
+    total: int
+    page: int
+    total_pages: int
 
 
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+def _catalog_changed() -> None:
+    global _catalog_version
+    _catalog_version += 1
+
+
+def catalog_version() -> int:
+    """Version of the subjects/lectures/links data; changes after every mutation."""
+    return _catalog_version
+
+
+def _to_page(rows: list[aiosqlite.Row], page: int, page_size: int) -> Page:
+    """Build a Page from rows carrying the listing size in a ``_total`` column."""
+    items = [dict(r) for r in rows]
+    total = int(items[0]["_total"]) if items else 0
+    for it in items:
+        del it["_total"]
+    total_pages = max(1, math.ceil(total / page_size))
+    return Page(items, total, max(0, min(page, total_pages - 1)), total_pages)
+
+
+async def _wait_open() -> None:
+    """Wait out a replace_database() swap, unless this task runs it or holds the writer.
+
+    A writer that got the lock before the swap started finishes first: the swap
+    waits for the lock, so the writer must not wait for the swap.
+    """
+    if _open_gate.is_set() or _in_maintenance.get() or _write_owner is asyncio.current_task():
+        return
+    await _open_gate.wait()
+
+
 async def get_db() -> aiosqlite.Connection:
+    """The writer connection, or the pooled reader inside a ``@_read_only`` call."""
     global _connection
+    await _wait_open()
     if _connection is None:
         raise RuntimeError("Database not initialized. Call init_db() first.")
-    return _connection
+    counter = _call_counter.get()
+    if counter is not None:
+        counter.count += 1
+    return _read_conn.get() or _connection
+
+
+@asynccontextmanager
+async def _reading() -> AsyncIterator[None]:
+    """Route get_db() in this block to a pooled reader (waits if all are busy)."""
+    await _wait_open()
+    global _writer_reads
+    pool = _readers
+    if _read_conn.get() is not None:
+        yield
+        return
+    if pool is None:
+        _writer_reads += 1
+        try:
+            yield
+        finally:
+            _writer_reads -= 1
+        return
+    conn = await pool.get()
+    token = _read_conn.set(conn)
+    try:
+        yield
+    finally:
+        _read_conn.reset(token)
+        pool.put_nowait(conn)
+
+
+_F = TypeVar("_F", bound=Callable[..., Awaitable[Any]])
+
+
+def _read_only(fn: _F) -> _F:
+    """Run a query-only function on the read pool. Never use on writing functions."""
+
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        async with _reading():
+            return await fn(*args, **kwargs)
+
+    return wrapper  # type: ignore[return-value]
+
+
+@asynccontextmanager
+async def _writing() -> AsyncIterator[None]:
+    """Own the writer for this block: committed at the end, rolled back on error."""
+    global _write_owner
+    task = asyncio.current_task()
+    if _write_owner is task:
+        yield
+        return
+    await _wait_open()
+    async with _write_lock:
+        _write_owner = task
+        try:
+            yield
+            if _connection is not None and _connection.in_transaction:
+                await _connection.commit()
+        except BaseException:
+            if _connection is not None and _connection.in_transaction:
+                await _connection.rollback()
+            raise
+        finally:
+            _write_owner = None
+
+
+def _writes(fn: _F) -> _F:
+    """Run a writing function as one unit on the writer (see _writing)."""
+
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        async with _writing():
+            return await fn(*args, **kwargs)
+
+    return wrapper  # type: ignore[return-value]
+
+
+def is_open() -> bool:
+    return _connection is not None
+
+
+def total_changes() -> int:
+    """Rows written through the writer connection(s) since the process started."""
+    return _changes_offset + (_connection.total_changes if _connection is not None else 0)
+
+
+def pool_stats() -> dict[str, int]:
+    """Read pool size and connections currently idle."""
+    return {
+        "size": len(_all_readers),
+        "idle": _readers.qsize() if _readers is not None else 0,
+    }
+
+
+def count_calls() -> CallCounter:
+    """Start counting DB calls made in the current task/context."""
+    counter = CallCounter()
+    _call_counter.set(counter)
+    return counter
 
 
 async def init_db() -> None:
     global _connection
+    invalidate_caches()
     _connection = await aiosqlite.connect(DATABASE_PATH)
     _connection.row_factory = aiosqlite.Row
-    await _connection.execute("PRAGMA foreign_keys = ON")
     await _connection.execute("PRAGMA journal_mode = WAL")
 
-    await _connection.executescript(
+    try:
+        await _setup(_connection)
+        await _open_readers(DB_READ_POOL_SIZE)
+        # Warm the settings/admin caches so per-update checks never hit SQLite.
+        await _settings()
+        await _admin_ids()
+    except BaseException:
+        await close_db()
+        raise
+    _start_background_migrations()
+
+
+async def _setup(conn: aiosqlite.Connection) -> None:
+    """Migrate the schema and seed the main admin: what init_db does to the file."""
+    await conn.execute("PRAGMA foreign_keys = ON")
+    await _migrate(conn)
+    cur = await conn.execute("SELECT 1 FROM admins WHERE user_id = ?", (ADMIN_ID,))
+    if await cur.fetchone() is None:
+        await conn.execute(
+            "INSERT INTO admins (user_id, added_by, created_at) VALUES (?, NULL, ?)",
+            (ADMIN_ID, _now_iso()),
+        )
+        await conn.commit()
+
+
+async def _table_columns(conn: aiosqlite.Connection) -> dict[str, set[str]]:
+    cur = await conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    tables = [r[0] for r in await cur.fetchall()]
+    columns = {}
+    for table in tables:
+        cur = await conn.execute(f'PRAGMA table_info("{table}")')
+        columns[table] = {r[1] for r in await cur.fetchall()}
+    return columns
+
+
+async def check_database(path: str) -> None:
+    """Run init_db's migrations and checks on the database file at ``path``.
+
+    Meant for a restore candidate before it replaces DATABASE_PATH; the file is
+    left migrated. Raises RuntimeError when a table lacks columns a fresh schema
+    has, or the sqlite3 error of a failing migration.
+    """
+    conn = await aiosqlite.connect(path)
+    fresh = await aiosqlite.connect(":memory:")
+    try:
+        conn.row_factory = fresh.row_factory = aiosqlite.Row
+        await _setup(conn)
+        await _migrate(fresh)
+        have = await _table_columns(conn)
+        for table, columns in (await _table_columns(fresh)).items():
+            missing = columns - have.get(table, set())
+            if missing:
+                raise RuntimeError(f"{table}: missing columns {', '.join(sorted(missing))}")
+    finally:
+        await fresh.close()
+        await conn.close()
+
+
+async def _open_readers(size: int) -> None:
+    """Open the read pool; needs the schema and WAL mode set up by the writer."""
+    global _readers
+    if size <= 0:
+        return
+    uri = "file:" + quote(os.path.abspath(DATABASE_PATH)) + "?mode=ro"
+    pool: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+    for _ in range(size):
+        conn = await aiosqlite.connect(uri, uri=True)
+        conn.row_factory = aiosqlite.Row
+        _all_readers.append(conn)
+        pool.put_nowait(conn)
+    _readers = pool
+
+
+async def _ensure_column(
+    conn: aiosqlite.Connection, table: str, column: str, decl: str
+) -> None:
+    cur = await conn.execute(f"PRAGMA table_info({table})")
+    if any(r["name"] == column for r in await cur.fetchall()):
+        return
+    await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    await conn.commit()
+
+
+# --- Schema migrations ---
+#
+# PRAGMA user_version counts the steps in _MIGRATIONS already applied; init_db
+# runs only the pending ones, in order, each committed with its version bump.
+# Steps must stay idempotent (IF NOT EXISTS, _ensure_column): databases created
+# before versioning start at 0 and replay every step over their existing schema,
+# and a crash between a step and its bump replays that step. Never edit a step
+# that has shipped; append a new one.
+
+
+async def _m_core_tables(conn: aiosqlite.Connection) -> None:
+    await conn.executescript(
         """
         CREATE TABLE IF NOT EXISTS users (
             user_id INTEGER PRIMARY KEY,
@@ -92,78 +404,585 @@ async def init_db() -> None:
             created_at TEXT NOT NULL
         );
 
-        CREATE INDEX IF NOT EXISTS idx_lectures_subject ON lectures(subject_id);
-        CREATE INDEX IF NOT EXISTS idx_lectures_created ON lectures(created_at DESC);
+        DROP TABLE IF EXISTS favorites;
+        INSERT OR IGNORE INTO settings (key, value) VALUES ('bot_running', '1');
         """
     )
-    await _connection.commit()
-    await _connection.execute("DROP TABLE IF EXISTS favorites")
-    await _connection.commit()
 
-    cur = await _connection.execute(
-        "SELECT 1 FROM settings WHERE key = 'bot_running' LIMIT 1"
+
+async def _m_search_keys(conn: aiosqlite.Connection) -> None:
+    # Existing rows are filled in by the background migrations below.
+    await _ensure_column(conn, "subjects", "name_norm", "TEXT NOT NULL DEFAULT ''")
+    await _ensure_column(conn, "lectures", "title_norm", "TEXT NOT NULL DEFAULT ''")
+
+
+async def _m_counters(conn: aiosqlite.Connection) -> None:
+    await conn.executescript(
+        """
+        -- Materialized row counts ('users', 'subjects', 'lectures', 'requests',
+        -- 'lectures:<subject_id>'), maintained by the triggers below.
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID;
+
+        CREATE TRIGGER IF NOT EXISTS users_count_ai AFTER INSERT ON users BEGIN
+            INSERT INTO counters (name, value) VALUES ('users', 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS users_count_ad AFTER DELETE ON users BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = 'users';
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS subjects_count_ai AFTER INSERT ON subjects BEGIN
+            INSERT INTO counters (name, value) VALUES ('subjects', 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS subjects_count_ad AFTER DELETE ON subjects BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = 'subjects';
+            DELETE FROM counters WHERE name = 'lectures:' || old.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS lectures_count_ai AFTER INSERT ON lectures BEGIN
+            INSERT INTO counters (name, value) VALUES ('lectures', 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+            INSERT INTO counters (name, value) VALUES ('lectures:' || new.subject_id, 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS lectures_count_ad AFTER DELETE ON lectures BEGIN
+            UPDATE counters SET value = value - 1
+            WHERE name IN ('lectures', 'lectures:' || old.subject_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS lectures_count_au AFTER UPDATE OF subject_id ON lectures
+        WHEN old.subject_id <> new.subject_id BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = 'lectures:' || old.subject_id;
+            INSERT INTO counters (name, value) VALUES ('lectures:' || new.subject_id, 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS requests_count_ai AFTER INSERT ON requests BEGIN
+            INSERT INTO counters (name, value) VALUES ('requests', 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS requests_count_ad AFTER DELETE ON requests BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = 'requests';
+        END;
+        """
     )
+    cur = await conn.execute("SELECT 1 FROM counters LIMIT 1")
     if await cur.fetchone() is None:
-        await _connection.execute(
-            "INSERT INTO settings (key, value) VALUES ('bot_running', '1')"
-        )
-    await _connection.commit()
+        await _recount_counters(conn)
+
+
+async def _m_seek_indexes(conn: aiosqlite.Connection) -> None:
+    await conn.executescript(
+        """
+        -- Composite keys match the keyset (seek) pagination orderings.
+        DROP INDEX IF EXISTS idx_lectures_subject;
+        DROP INDEX IF EXISTS idx_lectures_created;
+        CREATE INDEX IF NOT EXISTS idx_subjects_order ON subjects(sort_order, id);
+        CREATE INDEX IF NOT EXISTS idx_lectures_subject_order
+            ON lectures(subject_id, sort_order, id);
+        CREATE INDEX IF NOT EXISTS idx_lectures_created_id ON lectures(created_at, id);
+        """
+    )
+
+
+async def _m_search_index(conn: aiosqlite.Connection) -> None:
+    """(Re)build the lecture search index (FTS5) and its sync triggers.
+
+    Lectures are indexed by rowid = lectures.id with their normalized title and
+    subject name (see utils.arabic); triggers keep it in sync on add, rename,
+    move and delete (including cascades). A change to the index or its triggers
+    is a new migration step that drops and rebuilds it the same way.
+    """
+    await conn.executescript(
+        """
+        DROP TRIGGER IF EXISTS lectures_fts_ai;
+        DROP TRIGGER IF EXISTS lectures_fts_ad;
+        DROP TRIGGER IF EXISTS lectures_fts_au;
+        DROP TRIGGER IF EXISTS subjects_fts_au;
+        DROP TABLE IF EXISTS lectures_fts;
+
+        CREATE VIRTUAL TABLE lectures_fts USING fts5(
+            title_norm, name_norm, tokenize = 'trigram'
+        );
 
-    cur = await _connection.execute(
-        "SELECT 1 FROM admins WHERE user_id = ?", (ADMIN_ID,)
+        INSERT INTO lectures_fts (rowid, title_norm, name_norm)
+        SELECT l.id, l.title_norm, s.name_norm FROM lectures l
+        JOIN subjects s ON s.id = l.subject_id;
+
+        CREATE TRIGGER lectures_fts_ai AFTER INSERT ON lectures BEGIN
+            INSERT INTO lectures_fts (rowid, title_norm, name_norm)
+            SELECT new.id, new.title_norm, s.name_norm FROM subjects s
+            WHERE s.id = new.subject_id;
+        END;
+
+        CREATE TRIGGER lectures_fts_ad AFTER DELETE ON lectures BEGIN
+            DELETE FROM lectures_fts WHERE rowid = old.id;
+        END;
+
+        CREATE TRIGGER lectures_fts_au AFTER UPDATE OF title_norm, subject_id ON lectures BEGIN
+            DELETE FROM lectures_fts WHERE rowid = old.id;
+            INSERT INTO lectures_fts (rowid, title_norm, name_norm)
+            SELECT new.id, new.title_norm, s.name_norm FROM subjects s
+            WHERE s.id = new.subject_id;
+        END;
+
+        CREATE TRIGGER subjects_fts_au AFTER UPDATE OF name_norm ON subjects BEGIN
+            UPDATE lectures_fts SET name_norm = new.name_norm
+            WHERE rowid IN (SELECT id FROM lectures WHERE subject_id = new.id);
+        END;
+
+        -- Index version marker used before schema migrations.
+        DELETE FROM settings WHERE key = 'search_index_version';
+        """
     )
-    if await cur.fetchone() is None:
-        await _connection.execute(
-            "INSERT INTO admins (user_id, added_by, created_at) VALUES (?, NULL, ?)",
-            (ADMIN_ID, _now_iso()),
+
+
+async def _m_user_reachability(conn: aiosqlite.Connection) -> None:
+    await _ensure_column(conn, "users", "blocked_at", "TEXT")
+    await _ensure_column(conn, "users", "fail_count", "INTEGER NOT NULL DEFAULT 0")
+    # Broadcast recipients: only reachable users, in user_id order.
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_reachable ON users(user_id) "
+        "WHERE blocked_at IS NULL"
+    )
+
+
+async def _m_broadcasts(conn: aiosqlite.Connection) -> None:
+    await conn.executescript(
+        """
+        -- Background broadcasts; last_user_id is the resume checkpoint (users are
+        -- visited in user_id order, so everything <= last_user_id was attempted).
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER NOT NULL,
+            from_chat_id INTEGER,
+            message_id INTEGER,
+            text TEXT,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            ok INTEGER NOT NULL DEFAULT 0,
+            fail INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            finished_at TEXT
+        );
+        """
+    )
+
+
+async def _m_upload_sessions(conn: aiosqlite.Connection) -> None:
+    await conn.executescript(
+        """
+        -- Batch uploads staged as files arrive; promoted into lectures on finish.
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER NOT NULL,
+            subject_id INTEGER NOT NULL REFERENCES subjects(id) ON DELETE CASCADE,
+            progress_chat_id INTEGER,
+            progress_message_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'open',
+            created_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_upload_sessions_admin
+            ON upload_sessions(admin_id) WHERE status = 'open';
+
+        CREATE TABLE IF NOT EXISTS upload_session_files (
+            session_id INTEGER NOT NULL REFERENCES upload_sessions(id) ON DELETE CASCADE,
+            seq INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            title_norm TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            file_unique_id TEXT,
+            file_name TEXT,
+            PRIMARY KEY (session_id, seq)
+        ) WITHOUT ROWID;
+        """
+    )
+
+
+
+async def _m_drop_created_index(conn: aiosqlite.Connection) -> None:
+    # "Latest" pages are served from services.catalog; no query orders lectures
+    # by (created_at, id) any more.
+    await conn.executescript("DROP INDEX IF EXISTS idx_lectures_created_id;")
+
+
+# Position + 1 is the schema version the step brings the database to.
+_MIGRATIONS: list[Callable[[aiosqlite.Connection], Awaitable[None]]] = [
+    _m_core_tables,
+    _m_search_keys,
+    _m_counters,
+    _m_seek_indexes,
+    _m_search_index,
+    _m_user_reachability,
+    _m_broadcasts,
+    _m_upload_sessions,
+    _m_drop_created_index,
+]
+SCHEMA_VERSION = len(_MIGRATIONS)
+
+
+async def _migrate(conn: aiosqlite.Connection) -> None:
+    cur = await conn.execute("PRAGMA user_version")
+    version = int((await cur.fetchone())[0])
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema v{version} is newer than this code (v{SCHEMA_VERSION})."
         )
-        await _connection.commit()
+    for n in range(version + 1, SCHEMA_VERSION + 1):
+        logger.info("Applying schema migration %d/%d", n, SCHEMA_VERSION)
+        await _MIGRATIONS[n - 1](conn)
+        await conn.execute(f"PRAGMA user_version = {n}")
+        await conn.commit()
+
+
+@_writes
+async def _backfill_norm(
+    table: str, source: str, target: str, after_id: int, limit: int
+) -> Optional[int]:
+    """Normalize one batch of rows with an empty ``target``; returns the last id seen."""
+    db = await get_db()
+    cur = await db.execute(
+        f"SELECT id, {source} FROM {table} WHERE id > ? AND {target} = '' ORDER BY id LIMIT ?",
+        (after_id, limit),
+    )
+    rows = await cur.fetchall()
+    if not rows:
+        return None
+    await db.executemany(
+        f"UPDATE {table} SET {target} = ? WHERE id = ?",
+        [(normalize_arabic(r[1]), r[0]) for r in rows],
+    )
+    await db.commit()
+    return int(rows[-1][0])
+
+
+# Data migrations too large for startup: (name, batch step). They run in the
+# background after init_db, one short transaction per batch, and are recorded in
+# settings as migration:<name> = done.
+_BACKGROUND_MIGRATIONS: list[tuple[str, Callable[[int, int], Awaitable[Optional[int]]]]] = [
+    ("subjects_name_norm", functools.partial(_backfill_norm, "subjects", "name", "name_norm")),
+    ("lectures_title_norm", functools.partial(_backfill_norm, "lectures", "title", "title_norm")),
+]
+
+
+async def _run_background_migrations() -> None:
+    for name, step in _BACKGROUND_MIGRATIONS:
+        key = f"migration:{name}"
+        if await get_setting(key) == "done":
+            continue
+        after, batches = 0, 0
+        while (last := await step(after, MIGRATION_BATCH_SIZE)) is not None:
+            after, batches = last, batches + 1
+            # Let queued user queries take the writer between batches.
+            await asyncio.sleep(MIGRATION_BATCH_PAUSE_S)
+        await set_setting(key, "done")
+        logger.info("Background migration %s finished (%d batches)", name, batches)
+
+
+def _start_background_migrations() -> None:
+    global _background_migrations
+    task = asyncio.create_task(_run_background_migrations(), name="db-background-migrations")
+
+    def _done(t: asyncio.Task) -> None:
+        if not t.cancelled() and t.exception() is not None:
+            logger.error("Background migration failed", exc_info=t.exception())
+
+    task.add_done_callback(_done)
+    _background_migrations = task
 
 
 async def close_db() -> None:
-    global _connection
+    global _connection, _readers, _changes_offset, _background_migrations
+    if _background_migrations is not None:
+        _background_migrations.cancel()
+        await asyncio.gather(_background_migrations, return_exceptions=True)
+        _background_migrations = None
+    _readers = None
+    while _all_readers:
+        await _all_readers.pop().close()
     if _connection:
+        _changes_offset += _connection.total_changes
         await _connection.close()
         _connection = None
 
 
+async def _drain(timeout: float) -> None:
+    """Wait until no reader is borrowed and no read runs on the writer.
+
+    Writers are drained by holding the writer lock (see replace_database).
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        readers_idle = _readers is None or _readers.qsize() == len(_all_readers)
+        if readers_idle and not _writer_reads:
+            return
+        await asyncio.sleep(0.01)
+
+
+def _move_file(src: str, dest: str) -> None:
+    """Rename a database with its -wal/-shm files; stale ones at ``dest`` are dropped."""
+    # WAL files of one database must never be applied to another.
+    for suffix in ("-wal", "-shm"):
+        try:
+            os.remove(dest + suffix)
+        except FileNotFoundError:
+            pass
+    os.replace(src, dest)
+    for suffix in ("-wal", "-shm"):
+        try:
+            os.replace(src + suffix, dest + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def _remove_file(path: str) -> None:
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+async def replace_database(new_path: str, drain_timeout: float = 10.0) -> None:
+    """Atomically swap DATABASE_PATH for the checked file ``new_path`` and reopen.
+
+    ``new_path`` must be on the same filesystem as DATABASE_PATH (see
+    check_database). New queries wait until the swap is done. Writing functions
+    already running finish first (the swap holds the writer lock); reads get
+    ``drain_timeout`` seconds. If init_db fails on the new
+    file, the old one is moved back and reopened before the error propagates.
+    Caches are dropped and the catalog version is bumped.
+    """
+    global _changes_offset
+    previous = DATABASE_PATH + ".previous"
+    _open_gate.clear()
+    token = _in_maintenance.set(True)
+    try:
+        async with _writing():
+            await _drain(drain_timeout)
+            await close_db()
+            await asyncio.to_thread(_move_file, DATABASE_PATH, previous)
+            await asyncio.to_thread(_move_file, new_path, DATABASE_PATH)
+            try:
+                await init_db()
+            except BaseException:
+                logger.exception("Replacement database failed to open; restoring the old one")
+                await close_db()
+                await asyncio.to_thread(_move_file, previous, DATABASE_PATH)
+                await init_db()
+                raise
+            await asyncio.to_thread(_remove_file, previous)
+            _changes_offset += 1  # a restore counts as a change for backup_job
+            _catalog_changed()
+    finally:
+        _in_maintenance.reset(token)
+        _open_gate.set()
+
+
+# --- Counters ---
+
+
+@_read_only
+async def _counter(name: str) -> int:
+    db = await get_db()
+    cur = await db.execute("SELECT value FROM counters WHERE name = ?", (name,))
+    row = await cur.fetchone()
+    return int(row[0]) if row else 0
+
+
+@_writes
+async def recount_counters() -> list[tuple[str, int, int]]:
+    """Rebuild all counters with real COUNT(*)s.
+
+    Returns the counters that had drifted as (name, old_value, new_value).
+    """
+    return await _recount_counters(await get_db())
+
+
+async def _recount_counters(db: aiosqlite.Connection) -> list[tuple[str, int, int]]:
+    # Upserts in place (no DELETE of the whole table); committed by the caller's
+    # unit (@_writes or _migrate), so a failure leaves the old counters intact.
+    cur = await db.execute("SELECT name, value FROM counters")
+    before = {r["name"]: int(r["value"]) for r in await cur.fetchall()}
+    cur = await db.execute(
+        """
+        SELECT 'users', COUNT(*) FROM users
+        UNION ALL SELECT 'subjects', COUNT(*) FROM subjects
+        UNION ALL SELECT 'lectures', COUNT(*) FROM lectures
+        UNION ALL SELECT 'requests', COUNT(*) FROM requests
+        UNION ALL
+        SELECT 'lectures:' || subject_id, COUNT(*) FROM lectures GROUP BY subject_id
+        """
+    )
+    after = {str(r[0]): int(r[1]) for r in await cur.fetchall()}
+    await db.executemany(
+        "INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)", list(after.items())
+    )
+    await db.executemany(
+        "DELETE FROM counters WHERE name = ?", [(name,) for name in before.keys() - after.keys()]
+    )
+    drift = []
+    for name in sorted(before.keys() | after.keys()):
+        old, new = before.get(name, 0), after.get(name, 0)
+        if old != new:
+            drift.append((name, old, new))
+    return drift
+
+
 # --- Users ---
 
 
+# A sighting proves the user is reachable again only if it is newer than the
+# block: write-behind sightings (services/activity) can be flushed after it.
+_UPSERT_USER_SQL = """
+    INSERT INTO users (user_id, username, first_name, created_at, last_active)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        username = excluded.username,
+        first_name = excluded.first_name,
+        last_active = excluded.last_active,
+        blocked_at = CASE WHEN excluded.last_active > blocked_at THEN NULL ELSE blocked_at END,
+        fail_count = CASE
+            WHEN blocked_at IS NULL OR excluded.last_active > blocked_at THEN 0
+            ELSE fail_count
+        END
+"""
+
+
+@_writes
 async def upsert_user(user_id: int, username: Optional[str], first_name: Optional[str]) -> None:
     db = await get_db()
     now = _now_iso()
     await db.execute(
-        """
-        INSERT INTO users (user_id, username, first_name, created_at, last_active)
-        VALUES (?, ?, ?, ?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET
-            username = excluded.username,
-            first_name = excluded.first_name,
-            last_active = excluded.last_active
-        """,
+        _UPSERT_USER_SQL,
         (user_id, username or "", first_name or "", now, now),
     )
     await db.commit()
 
 
+@_writes
+async def upsert_users_bulk(
+    rows: list[tuple[int, Optional[str], Optional[str], str, str]],
+) -> None:
+    """Upsert many users in one transaction.
+
+    Each row is ``(user_id, username, first_name, first_seen, last_seen)``.
+    """
+    if not rows:
+        return
+    db = await get_db()
+    await db.executemany(
+        _UPSERT_USER_SQL,
+        [(uid, un or "", fn or "", first, last) for uid, un, fn, first, last in rows],
+    )
+    await db.commit()
+
+
+@_read_only
 async def count_users() -> int:
+    return await _counter("users")
+
+
+@_writes
+async def set_user_blocked(user_id: int, blocked: bool) -> None:
+    """Record a my_chat_member change: the user blocked or unblocked the bot."""
+    db = await get_db()
+    if blocked:
+        await db.execute(
+            "UPDATE users SET blocked_at = COALESCE(blocked_at, ?) WHERE user_id = ?",
+            (_now_iso(), user_id),
+        )
+    else:
+        await db.execute(
+            "UPDATE users SET blocked_at = NULL, fail_count = 0 WHERE user_id = ?",
+            (user_id,),
+        )
+    await db.commit()
+
+
+@_writes
+async def record_delivery_results(
+    delivered: list[int], blocked: list[int], failed: list[int], max_failures: int
+) -> None:
+    """Apply one broadcast chunk's outcome in a single transaction.
+
+    ``blocked`` users (Forbidden) are marked unreachable at once; ``failed`` users
+    become unreachable after ``max_failures`` consecutive failures.
+    """
     db = await get_db()
-    cur = await db.execute("SELECT COUNT(*) FROM users")
+    now = _now_iso()
+    if delivered:
+        await db.executemany(
+            "UPDATE users SET fail_count = 0 WHERE user_id = ? AND fail_count > 0",
+            [(uid,) for uid in delivered],
+        )
+    if blocked:
+        await db.executemany(
+            "UPDATE users SET blocked_at = ?, fail_count = fail_count + 1 "
+            "WHERE user_id = ? AND blocked_at IS NULL",
+            [(now, uid) for uid in blocked],
+        )
+    if failed:
+        await db.executemany(
+            """
+            UPDATE users SET
+                fail_count = fail_count + 1,
+                blocked_at = CASE WHEN fail_count + 1 >= ? THEN ? ELSE blocked_at END
+            WHERE user_id = ?
+            """,
+            [(max_failures, now, uid) for uid in failed],
+        )
+    await db.commit()
+
+
+@_read_only
+async def reachability_stats(since: Optional[str] = None) -> dict[str, int]:
+    """Unreachable users in total and since ``since`` (ISO time), plus failing ones."""
+    db = await get_db()
+    cur = await db.execute(
+        """
+        SELECT
+            COUNT(*) FILTER (WHERE blocked_at IS NOT NULL),
+            COUNT(*) FILTER (WHERE blocked_at >= ?),
+            COUNT(*) FILTER (WHERE blocked_at IS NULL AND fail_count > 0)
+        FROM users
+        """,
+        (since or "",),
+    )
     row = await cur.fetchone()
-    return int(row[0]) if row else 0
+    return {"unreachable": row[0], "new_unreachable": row[1], "failing": row[2]}
 
 
 # --- Settings ---
 
 
-async def get_setting(key: str, default: str = "") -> str:
+async def _settings() -> dict[str, str]:
+    # Hits must not borrow a pooled reader; only the miss goes through _read_only.
+    global _settings_cache, _cache_hits, _cache_misses
+    if _settings_cache is not None:
+        _cache_hits += 1
+        return _settings_cache
+    _cache_misses += 1
+    _settings_cache = await _load_settings()
+    return _settings_cache
+
+
+@_read_only
+async def _load_settings() -> dict[str, str]:
     db = await get_db()
-    cur = await db.execute("SELECT value FROM settings WHERE key = ?", (key,))
-    row = await cur.fetchone()
-    return str(row[0]) if row else default
+    cur = await db.execute("SELECT key, value FROM settings")
+    return {str(r[0]): str(r[1]) for r in await cur.fetchall()}
+
+
+async def get_setting(key: str, default: str = "") -> str:
+    return (await _settings()).get(key, default)
 
 
+@_writes
 async def set_setting(key: str, value: str) -> None:
     db = await get_db()
     await db.execute(
@@ -174,23 +993,52 @@ async def set_setting(key: str, value: str) -> None:
         (key, value),
     )
     await db.commit()
+    if _settings_cache is not None:
+        _settings_cache[key] = value
 
 
 async def is_bot_running() -> bool:
     return (await get_setting("bot_running", "1")) == "1"
 
 
+def invalidate_caches() -> None:
+    """Drop the settings/admin caches; the next read reloads them from the DB."""
+    global _settings_cache, _admin_ids_cache
+    _settings_cache = None
+    _admin_ids_cache = None
+
+
+def cache_stats() -> dict[str, int]:
+    return {"hits": _cache_hits, "misses": _cache_misses}
+
+
 # --- Admins ---
 
 
+async def _admin_ids() -> frozenset[int]:
+    global _admin_ids_cache, _cache_hits, _cache_misses
+    if _admin_ids_cache is not None:
+        _cache_hits += 1
+        return _admin_ids_cache
+    _cache_misses += 1
+    _admin_ids_cache = await _load_admin_ids()
+    return _admin_ids_cache
+
+
+@_read_only
+async def _load_admin_ids() -> frozenset[int]:
+    db = await get_db()
+    cur = await db.execute("SELECT user_id FROM admins")
+    return frozenset(int(r[0]) for r in await cur.fetchall())
+
+
 async def is_admin(user_id: int) -> bool:
     if user_id == ADMIN_ID:
         return True
-    db = await get_db()
-    cur = await db.execute("SELECT 1 FROM admins WHERE user_id = ?", (user_id,))
-    return await cur.fetchone() is not None
+    return user_id in await _admin_ids()
 
 
+@_read_only
 async def list_admins() -> list[dict[str, Any]]:
     db = await get_db()
     cur = await db.execute(
@@ -200,7 +1048,9 @@ async def list_admins() -> list[dict[str, Any]]:
     return [dict(r) for r in rows]
 
 
+@_writes
 async def add_admin(user_id: int, added_by: int) -> bool:
+    global _admin_ids_cache
     if user_id == ADMIN_ID:
         return True
     db = await get_db()
@@ -210,41 +1060,48 @@ async def add_admin(user_id: int, added_by: int) -> bool:
             (user_id, added_by, _now_iso()),
         )
         await db.commit()
-        return True
     except aiosqlite.IntegrityError:
         return False
+    if _admin_ids_cache is not None:
+        _admin_ids_cache = _admin_ids_cache | {user_id}
+    return True
 
 
+@_writes
 async def remove_admin(user_id: int) -> bool:
+    global _admin_ids_cache
     if user_id == ADMIN_ID:
         return False
     db = await get_db()
     cur = await db.execute("DELETE FROM admins WHERE user_id = ?", (user_id,))
     await db.commit()
+    if _admin_ids_cache is not None:
+        _admin_ids_cache = _admin_ids_cache - {user_id}
     return cur.rowcount > 0
 
 
 # --- Subjects ---
 
 
+@_writes
 async def add_subject(name: str) -> tuple[bool, Optional[int]]:
     db = await get_db()
     cur = await db.execute("SELECT COALESCE(MAX(sort_order), -1) + 1 FROM subjects")
     row = await cur.fetchone()
     sort_order = int(row[0]) if row else 0
     try:
-        await db.execute(
-            "INSERT INTO subjects (name, sort_order) VALUES (?, ?)",
-            (name.strip(), sort_order),
+        cur = await db.execute(
+            "INSERT INTO subjects (name, sort_order, name_norm) VALUES (?, ?, ?)",
+            (name.strip(), sort_order, normalize_arabic(name)),
         )
         await db.commit()
-        cur = await db.execute("SELECT last_insert_rowid()")
-        rid = await cur.fetchone()
-        return True, int(rid[0]) if rid else None
+        _catalog_changed()
+        return True, cur.lastrowid
     except aiosqlite.IntegrityError:
         return False, None
 
 
+@_read_only
 async def get_subject(subject_id: int) -> Optional[dict[str, Any]]:
     db = await get_db()
     cur = await db.execute("SELECT * FROM subjects WHERE id = ?", (subject_id,))
@@ -252,6 +1109,7 @@ async def get_subject(subject_id: int) -> Optional[dict[str, Any]]:
     return dict(row) if row else None
 
 
+@_read_only
 async def list_subjects_page(offset: int, limit: int) -> list[dict[str, Any]]:
     db = await get_db()
     cur = await db.execute(
@@ -262,31 +1120,45 @@ async def list_subjects_page(offset: int, limit: int) -> list[dict[str, Any]]:
     return [dict(r) for r in rows]
 
 
-async def count_subjects() -> int:
+@_read_only
+async def list_all_subjects() -> list[dict[str, Any]]:
     db = await get_db()
-    cur = await db.execute("SELECT COUNT(*) FROM subjects")
-    row = await cur.fetchone()
-    return int(row[0]) if row else 0
+    cur = await db.execute(
+        "SELECT id, name, sort_order FROM subjects ORDER BY sort_order, id"
+    )
+    rows = await cur.fetchall()
+    return [dict(r) for r in rows]
+
+
+@_read_only
+async def count_subjects() -> int:
+    return await _counter("subjects")
 
 
+@_writes
 async def update_subject_name(subject_id: int, name: str) -> bool:
     db = await get_db()
     try:
         await db.execute(
-            "UPDATE subjects SET name = ? WHERE id = ?", (name.strip(), subject_id)
+            "UPDATE subjects SET name = ?, name_norm = ? WHERE id = ?",
+            (name.strip(), normalize_arabic(name), subject_id),
         )
         await db.commit()
+        _catalog_changed()
         return True
     except aiosqlite.IntegrityError:
         return False
 
 
+@_writes
 async def delete_subject(subject_id: int) -> None:
     db = await get_db()
     await db.execute("DELETE FROM subjects WHERE id = ?", (subject_id,))
     await db.commit()
+    _catalog_changed()
 
 
+@_writes
 async def reorder_subjects(ordered_ids: list[int]) -> None:
     db = await get_db()
     for i, sid in enumerate(ordered_ids):
@@ -294,8 +1166,10 @@ async def reorder_subjects(ordered_ids: list[int]) -> None:
             "UPDATE subjects SET sort_order = ? WHERE id = ?", (i, sid)
         )
     await db.commit()
+    _catalog_changed()
 
 
+@_read_only
 async def list_all_subject_ids_ordered() -> list[int]:
     db = await get_db()
     cur = await db.execute("SELECT id FROM subjects ORDER BY sort_order, id")
@@ -306,6 +1180,7 @@ async def list_all_subject_ids_ordered() -> list[int]:
 # --- Lectures ---
 
 
+@_writes
 async def add_lecture(
     subject_id: int,
     title: str,
@@ -321,19 +1196,31 @@ async def add_lecture(
     row = await cur.fetchone()
     sort_order = int(row[0]) if row else 0
     now = _now_iso()
-    await db.execute(
+    cur = await db.execute(
         """
-        INSERT INTO lectures (subject_id, title, file_id, file_unique_id, file_name, sort_order, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO lectures (
+            subject_id, title, file_id, file_unique_id, file_name, sort_order, created_at,
+            title_norm
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """,
-        (subject_id, title, file_id, file_unique_id, file_name, sort_order, now),
+        (
+            subject_id,
+            title,
+            file_id,
+            file_unique_id,
+            file_name,
+            sort_order,
+            now,
+            normalize_arabic(title),
+        ),
     )
     await db.commit()
-    cur = await db.execute("SELECT last_insert_rowid()")
-    rid = await cur.fetchone()
-    return int(rid[0]) if rid else 0
+    _catalog_changed()
+    return int(cur.lastrowid or 0)
 
 
+@_read_only
 async def get_lecture(lecture_id: int) -> Optional[dict[str, Any]]:
     db = await get_db()
     cur = await db.execute("SELECT * FROM lectures WHERE id = ?", (lecture_id,))
@@ -341,15 +1228,12 @@ async def get_lecture(lecture_id: int) -> Optional[dict[str, Any]]:
     return dict(row) if row else None
 
 
+@_read_only
 async def count_lectures_in_subject(subject_id: int) -> int:
-    db = await get_db()
-    cur = await db.execute(
-        "SELECT COUNT(*) FROM lectures WHERE subject_id = ?", (subject_id,)
-    )
-    row = await cur.fetchone()
-    return int(row[0]) if row else 0
+    return await _counter(f"lectures:{subject_id}")
 
 
+@_read_only
 async def list_lectures_page(subject_id: int, offset: int, limit: int) -> list[dict[str, Any]]:
     db = await get_db()
     cur = await db.execute(
@@ -363,27 +1247,31 @@ async def list_lectures_page(subject_id: int, offset: int, limit: int) -> list[d
     return [dict(r) for r in rows]
 
 
+@_read_only
 async def count_lectures_total() -> int:
-    db = await get_db()
-    cur = await db.execute("SELECT COUNT(*) FROM lectures")
-    row = await cur.fetchone()
-    return int(row[0]) if row else 0
+    return await _counter("lectures")
 
 
+@_writes
 async def delete_lecture(lecture_id: int) -> None:
     db = await get_db()
     await db.execute("DELETE FROM lectures WHERE id = ?", (lecture_id,))
     await db.commit()
+    _catalog_changed()
 
 
+@_writes
 async def update_lecture_title(lecture_id: int, title: str) -> None:
     db = await get_db()
     await db.execute(
-        "UPDATE lectures SET title = ? WHERE id = ?", (title.strip(), lecture_id)
+        "UPDATE lectures SET title = ?, title_norm = ? WHERE id = ?",
+        (title.strip(), normalize_arabic(title), lecture_id),
     )
     await db.commit()
+    _catalog_changed()
 
 
+@_writes
 async def update_lecture_file(
     lecture_id: int,
     file_id: str,
@@ -395,10 +1283,18 @@ async def update_lecture_file(
     if title_from_file:
         await db.execute(
             """
-            UPDATE lectures SET file_id = ?, file_unique_id = ?, file_name = ?, title = ?
+            UPDATE lectures SET file_id = ?, file_unique_id = ?, file_name = ?, title = ?,
+                title_norm = ?
             WHERE id = ?
             """,
-            (file_id, file_unique_id, file_name, title_from_file.strip(), lecture_id),
+            (
+                file_id,
+                file_unique_id,
+                file_name,
+                title_from_file.strip(),
+                normalize_arabic(title_from_file),
+                lecture_id,
+            ),
         )
     else:
         await db.execute(
@@ -409,8 +1305,10 @@ async def update_lecture_file(
             (file_id, file_unique_id, file_name, lecture_id),
         )
     await db.commit()
+    _catalog_changed()
 
 
+@_writes
 async def move_lecture(lecture_id: int, new_subject_id: int) -> None:
     db = await get_db()
     cur = await db.execute(
@@ -424,17 +1322,21 @@ async def move_lecture(lecture_id: int, new_subject_id: int) -> None:
         (new_subject_id, sort_order, lecture_id),
     )
     await db.commit()
+    _catalog_changed()
 
 
+@_writes
 async def delete_all_lectures_in_subject(subject_id: int) -> int:
     db = await get_db()
     cur = await db.execute(
         "DELETE FROM lectures WHERE subject_id = ?", (subject_id,)
     )
     await db.commit()
+    _catalog_changed()
     return cur.rowcount
 
 
+@_writes
 async def reorder_lectures(subject_id: int, ordered_ids: list[int]) -> None:
     db = await get_db()
     for i, lid in enumerate(ordered_ids):
@@ -443,8 +1345,10 @@ async def reorder_lectures(subject_id: int, ordered_ids: list[int]) -> None:
             (i, lid, subject_id),
         )
     await db.commit()
+    _catalog_changed()
 
 
+@_read_only
 async def list_all_lectures_in_subject(subject_id: int) -> list[dict[str, Any]]:
     db = await get_db()
     cur = await db.execute(
@@ -458,87 +1362,99 @@ async def list_all_lectures_in_subject(subject_id: int) -> list[dict[str, Any]]:
     return [dict(r) for r in rows]
 
 
-async def list_lecture_ids_in_subject_ordered(subject_id: int) -> list[int]:
+@_read_only
+async def list_all_lectures() -> list[dict[str, Any]]:
+    """Every lecture (browse columns only), ordered by subject then (sort_order, id)."""
     db = await get_db()
     cur = await db.execute(
-        "SELECT id FROM lectures WHERE subject_id = ? ORDER BY sort_order, id",
-        (subject_id,),
+        """
+        SELECT id, subject_id, title, file_id, sort_order, created_at FROM lectures
+        ORDER BY subject_id, sort_order, id
+        """
     )
     rows = await cur.fetchall()
-    return [int(r[0]) for r in rows]
+    return [dict(r) for r in rows]
 
 
-async def search_lectures_page(
-    query: str, offset: int, limit: int
-) -> list[dict[str, Any]]:
+@_read_only
+async def list_lecture_ids_in_subject_ordered(subject_id: int) -> list[int]:
     db = await get_db()
-    like = f"%{query.strip()}%"
     cur = await db.execute(
-        """
-        SELECT l.*, s.name AS subject_name FROM lectures l
-        JOIN subjects s ON s.id = l.subject_id
-        WHERE l.title LIKE ? OR s.name LIKE ?
-        ORDER BY l.created_at DESC
-        LIMIT ? OFFSET ?
-        """,
-        (like, like, limit, offset),
+        "SELECT id FROM lectures WHERE subject_id = ? ORDER BY sort_order, id",
+        (subject_id,),
     )
     rows = await cur.fetchall()
-    return [dict(r) for r in rows]
+    return [int(r[0]) for r in rows]
 
 
-async def count_search_lectures(query: str) -> int:
-    db = await get_db()
-    like = f"%{query.strip()}%"
-    cur = await db.execute(
-        """
-        SELECT COUNT(*) FROM lectures l
-        JOIN subjects s ON s.id = l.subject_id
-        WHERE l.title LIKE ? OR s.name LIKE ?
-        """,
-        (like, like),
-    )
-    row = await cur.fetchone()
-    return int(row[0]) if row else 0
+def _fts_phrase(query: str) -> Optional[str]:
+    """Quote the key as one FTS5 phrase; None if too short for the trigram index."""
+    q = query.strip()
+    if len(q) < _FTS_MIN_QUERY_LEN:
+        return None
+    return '"' + q.replace('"', '""') + '"'
 
 
-async def latest_lectures_page(offset: int, limit: int) -> list[dict[str, Any]]:
+@_read_only
+async def search_lectures(key: str, page: int, page_size: int) -> Page:
+    """Ranked search by a key already passed through utils.arabic.normalize_arabic.
+
+    Rows carry subject_name; the match count comes from ``COUNT(*) OVER ()``
+    in the same statement.
+    """
     db = await get_db()
-    cur = await db.execute(
-        """
-        SELECT l.*, s.name AS subject_name FROM lectures l
-        JOIN subjects s ON s.id = l.subject_id
-        ORDER BY l.created_at DESC
-        LIMIT ? OFFSET ?
-        """,
-        (limit, offset),
-    )
+    offset = page * page_size
+    phrase = _fts_phrase(key)
+    if phrase is None:
+        like = f"%{key.strip()}%"
+        cur = await db.execute(
+            """
+            SELECT l.*, s.name AS subject_name, COUNT(*) OVER () AS _total FROM lectures l
+            JOIN subjects s ON s.id = l.subject_id
+            WHERE l.title_norm LIKE ? OR s.name_norm LIKE ?
+            ORDER BY l.created_at DESC
+            LIMIT ? OFFSET ?
+            """,
+            (like, like, page_size, offset),
+        )
+    else:
+        cur = await db.execute(
+            """
+            SELECT l.*, s.name AS subject_name, COUNT(*) OVER () AS _total
+            FROM lectures_fts f
+            JOIN lectures l ON l.id = f.rowid
+            JOIN subjects s ON s.id = l.subject_id
+            WHERE lectures_fts MATCH ?
+            ORDER BY f.rank, l.created_at DESC
+            LIMIT ? OFFSET ?
+            """,
+            (phrase, page_size, offset),
+        )
     rows = await cur.fetchall()
-    return [dict(r) for r in rows]
-
-
-async def count_latest_lectures() -> int:
-    return await count_lectures_total()
+    if not rows and page > 0:
+        return await search_lectures(key, 0, page_size)
+    return _to_page(rows, page, page_size)
 
 
 # --- Links ---
 
 
+@_writes
 async def add_link(title: str, url: str) -> int:
     db = await get_db()
     cur = await db.execute("SELECT COALESCE(MAX(sort_order), -1) + 1 FROM links")
     row = await cur.fetchone()
     sort_order = int(row[0]) if row else 0
-    await db.execute(
+    cur = await db.execute(
         "INSERT INTO links (title, url, sort_order) VALUES (?, ?, ?)",
         (title.strip(), url.strip(), sort_order),
     )
     await db.commit()
-    cur = await db.execute("SELECT last_insert_rowid()")
-    rid = await cur.fetchone()
-    return int(rid[0]) if rid else 0
+    _catalog_changed()
+    return int(cur.lastrowid or 0)
 
 
+@_read_only
 async def get_link(link_id: int) -> Optional[dict[str, Any]]:
     db = await get_db()
     cur = await db.execute("SELECT * FROM links WHERE id = ?", (link_id,))
@@ -546,6 +1462,7 @@ async def get_link(link_id: int) -> Optional[dict[str, Any]]:
     return dict(row) if row else None
 
 
+@_read_only
 async def list_links() -> list[dict[str, Any]]:
     db = await get_db()
     cur = await db.execute("SELECT * FROM links ORDER BY sort_order, id")
@@ -553,31 +1470,40 @@ async def list_links() -> list[dict[str, Any]]:
     return [dict(r) for r in rows]
 
 
+@_writes
 async def delete_link(link_id: int) -> None:
     db = await get_db()
     await db.execute("DELETE FROM links WHERE id = ?", (link_id,))
     await db.commit()
+    _catalog_changed()
 
 
+@_writes
 async def update_link_title(link_id: int, title: str) -> None:
     db = await get_db()
     await db.execute("UPDATE links SET title = ? WHERE id = ?", (title.strip(), link_id))
     await db.commit()
+    _catalog_changed()
 
 
+@_writes
 async def update_link_url(link_id: int, url: str) -> None:
     db = await get_db()
     await db.execute("UPDATE links SET url = ? WHERE id = ?", (url.strip(), link_id))
     await db.commit()
+    _catalog_changed()
 
 
+@_writes
 async def reorder_links(ordered_ids: list[int]) -> None:
     db = await get_db()
     for i, lid in enumerate(ordered_ids):
         await db.execute("UPDATE links SET sort_order = ? WHERE id = ?", (i, lid))
     await db.commit()
+    _catalog_changed()
 
 
+@_read_only
 async def list_all_link_ids_ordered() -> list[int]:
     db = await get_db()
     cur = await db.execute("SELECT id FROM links ORDER BY sort_order, id")
@@ -588,9 +1514,10 @@ async def list_all_link_ids_ordered() -> list[int]:
 # --- Requests ---
 
 
+@_writes
 async def add_request(user_id: int, subject_name: str, lecture_name: str) -> int:
     db = await get_db()
-    await db.execute(
+    cur = await db.execute(
         """
         INSERT INTO requests (user_id, subject_name, lecture_name, created_at, status)
         VALUES (?, ?, ?, ?, 'pending')
@@ -598,21 +1525,303 @@ async def add_request(user_id: int, subject_name: str, lecture_name: str) -> int
         (user_id, subject_name.strip(), lecture_name.strip(), _now_iso()),
     )
     await db.commit()
-    cur = await db.execute("SELECT last_insert_rowid()")
-    rid = await cur.fetchone()
-    return int(rid[0]) if rid else 0
+    return int(cur.lastrowid or 0)
 
 
+@_read_only
 async def count_requests() -> int:
+    return await _counter("requests")
+
+
+# --- Upload sessions ---
+
+
+@_writes
+async def create_upload_session(admin_id: int, subject_id: int) -> int:
+    db = await get_db()
+    cur = await db.execute(
+        "INSERT INTO upload_sessions (admin_id, subject_id, created_at) VALUES (?, ?, ?)",
+        (admin_id, subject_id, _now_iso()),
+    )
+    await db.commit()
+    return int(cur.lastrowid)
+
+
+@_read_only
+async def get_open_upload_session(admin_id: int) -> Optional[dict[str, Any]]:
+    """The admin's open session with its subject name and staged file count."""
+    db = await get_db()
+    cur = await db.execute(
+        """
+        SELECT us.*, s.name AS subject_name,
+            (SELECT COUNT(*) FROM upload_session_files f WHERE f.session_id = us.id)
+                AS staged,
+            (SELECT COALESCE(MAX(seq), -1) + 1 FROM upload_session_files f
+                WHERE f.session_id = us.id) AS next_seq
+        FROM upload_sessions us
+        JOIN subjects s ON s.id = us.subject_id
+        WHERE us.admin_id = ? AND us.status = 'open'
+        ORDER BY us.id DESC LIMIT 1
+        """,
+        (admin_id,),
+    )
+    row = await cur.fetchone()
+    return dict(row) if row else None
+
+
+@_writes
+async def set_upload_session_progress(
+    session_id: int, progress_chat_id: int, progress_message_id: int
+) -> None:
+    db = await get_db()
+    await db.execute(
+        "UPDATE upload_sessions SET progress_chat_id = ?, progress_message_id = ? WHERE id = ?",
+        (progress_chat_id, progress_message_id, session_id),
+    )
+    await db.commit()
+
+
+@_writes
+async def stage_upload_files(session_id: int, files: list[dict[str, Any]]) -> None:
+    """Append files (``seq``, ``title``, ``file_id``, ...) to a session in one transaction."""
+    if not files:
+        return
     db = await get_db()
-    cur = await db.execute("SELECT COUNT(*) FROM requests")
+    await db.executemany(
+        """
+        INSERT OR IGNORE INTO upload_session_files (
+            session_id, seq, title, title_norm, file_id, file_unique_id, file_name
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                session_id,
+                f["seq"],
+                f["title"],
+                normalize_arabic(f["title"]),
+                f["file_id"],
+                f.get("file_unique_id"),
+                f.get("file_name"),
+            )
+            for f in files
+        ],
+    )
+    await db.commit()
+
+
+@dataclass(frozen=True)
+class PromoteResult:
+    """Outcome of promote_upload_session: lectures added, and failed items by ``seq``."""
+
+    added: int
+    failed: dict[int, str]
+
+
+_PROMOTE_COLUMNS = """
+    INSERT INTO lectures (
+        subject_id, title, file_id, file_unique_id, file_name, sort_order, created_at,
+        title_norm
+    )
+"""
+
+
+@_writes
+async def promote_upload_session(session_id: int) -> Optional[PromoteResult]:
+    """Move a session's staged files into lectures (INSERT ... SELECT).
+
+    Items the database rejects are reported in ``failed`` without aborting the
+    rest of the session. Returns None if the session is not open.
+    """
+    db = await get_db()
+    cur = await db.execute(
+        "SELECT subject_id FROM upload_sessions WHERE id = ? AND status = 'open'",
+        (session_id,),
+    )
     row = await cur.fetchone()
-    return int(row[0]) if row else 0
+    if row is None:
+        return None
+    subject_id = int(row[0])
+    now = _now_iso()
+    cur = await db.execute(
+        "SELECT seq FROM upload_session_files WHERE session_id = ? AND file_id = ''",
+        (session_id,),
+    )
+    failed = {int(r[0]): "missing file_id" for r in await cur.fetchall()}
+    # Outermost savepoint: it opens the transaction and RELEASE commits it.
+    await db.execute("SAVEPOINT promote")
+    try:
+        cur = await db.execute(
+            _PROMOTE_COLUMNS
+            + """
+            SELECT
+                :sid, f.title, f.file_id, f.file_unique_id, f.file_name,
+                (SELECT COALESCE(MAX(sort_order), -1) FROM lectures WHERE subject_id = :sid)
+                    + ROW_NUMBER() OVER (ORDER BY f.seq),
+                :now, f.title_norm
+            FROM upload_session_files f
+            WHERE f.session_id = :session AND f.file_id <> ''
+            ORDER BY f.seq
+            """,
+            {"sid": subject_id, "now": now, "session": session_id},
+        )
+        added = cur.rowcount
+    except aiosqlite.Error:
+        # Undo only this statement's rows, then insert one by one to find the bad items.
+        await db.execute("ROLLBACK TO promote")
+        added = await _promote_rows(db, session_id, subject_id, now, failed)
+    await db.execute("DELETE FROM upload_session_files WHERE session_id = ?", (session_id,))
+    await db.execute("UPDATE upload_sessions SET status = 'done' WHERE id = ?", (session_id,))
+    await db.execute("RELEASE promote")
+    await db.commit()
+    if added:
+        _catalog_changed()
+    return PromoteResult(added, failed)
+
+
+async def _promote_rows(
+    db: aiosqlite.Connection,
+    session_id: int,
+    subject_id: int,
+    now: str,
+    failed: dict[int, str],
+) -> int:
+    cur = await db.execute(
+        "SELECT COALESCE(MAX(sort_order), -1) + 1 FROM lectures WHERE subject_id = ?",
+        (subject_id,),
+    )
+    sort_order = int((await cur.fetchone())[0])
+    cur = await db.execute(
+        "SELECT seq, title, file_id, file_unique_id, file_name, title_norm "
+        "FROM upload_session_files WHERE session_id = ? AND file_id <> '' ORDER BY seq",
+        (session_id,),
+    )
+    added = 0
+    for r in await cur.fetchall():
+        try:
+            await db.execute(
+                _PROMOTE_COLUMNS + " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    subject_id,
+                    r["title"],
+                    r["file_id"],
+                    r["file_unique_id"],
+                    r["file_name"],
+                    sort_order,
+                    now,
+                    r["title_norm"],
+                ),
+            )
+        except aiosqlite.Error as e:
+            # A failed statement is undone on its own; the transaction goes on.
+            failed[int(r["seq"])] = str(e)
+            continue
+        sort_order += 1
+        added += 1
+    return added
+
+
+@_writes
+async def cancel_upload_session(session_id: int) -> None:
+    db = await get_db()
+    await db.execute("DELETE FROM upload_session_files WHERE session_id = ?", (session_id,))
+    await db.execute(
+        "UPDATE upload_sessions SET status = 'cancelled' WHERE id = ? AND status = 'open'",
+        (session_id,),
+    )
+    await db.commit()
+
+
+# --- Broadcasts ---
+
+
+async def iter_user_id_chunks(
+    after_user_id: int = 0, chunk_size: int = 500
+) -> AsyncIterator[list[int]]:
+    """Yield reachable user ids in ascending order, ``chunk_size`` per query.
+
+    Each chunk is a separate keyset query (``user_id > last``), so memory stays
+    bounded and no cursor is held open while the caller awaits between chunks.
+    """
+    last = after_user_id
+    while True:
+        # A reader per chunk: the pool is not held while the caller sends.
+        async with _reading():
+            db = await get_db()
+            cur = await db.execute(
+                "SELECT user_id FROM users INDEXED BY idx_users_reachable "
+                "WHERE blocked_at IS NULL AND user_id > ? ORDER BY user_id LIMIT ?",
+                (last, chunk_size),
+            )
+            chunk = [int(r[0]) for r in await cur.fetchall()]
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1]
+
+
+@_writes
+async def create_broadcast(
+    admin_id: int,
+    *,
+    from_chat_id: Optional[int] = None,
+    message_id: Optional[int] = None,
+    text: Optional[str] = None,
+) -> int:
+    db = await get_db()
+    cur = await db.execute(
+        """
+        INSERT INTO broadcasts (admin_id, from_chat_id, message_id, text, created_at)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (admin_id, from_chat_id, message_id, text, _now_iso()),
+    )
+    await db.commit()
+    return int(cur.lastrowid)
+
+
+@_read_only
+async def get_broadcast(broadcast_id: int) -> Optional[dict[str, Any]]:
+    db = await get_db()
+    cur = await db.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+    row = await cur.fetchone()
+    return dict(row) if row else None
+
+
+@_read_only
+async def list_running_broadcasts() -> list[dict[str, Any]]:
+    db = await get_db()
+    cur = await db.execute("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id")
+    rows = await cur.fetchall()
+    return [dict(r) for r in rows]
+
+
+@_writes
+async def checkpoint_broadcast(broadcast_id: int, last_user_id: int, ok: int, fail: int) -> None:
+    db = await get_db()
+    await db.execute(
+        "UPDATE broadcasts SET last_user_id = ?, ok = ?, fail = ? WHERE id = ?",
+        (last_user_id, ok, fail, broadcast_id),
+    )
+    await db.commit()
+
+
+@_writes
+async def finish_broadcast(broadcast_id: int, status: str = "done") -> None:
+    db = await get_db()
+    await db.execute(
+        "UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ?",
+        (status, _now_iso(), broadcast_id),
+    )
+    await db.commit()
 
 
 # --- Logs ---
 
 
+@_writes
 async def add_log(admin_id: int, action: str, details: Optional[str] = None) -> None:
     db = await get_db()
     await db.execute(
@@ -622,6 +1831,7 @@ async def add_log(admin_id: int, action: str, details: Optional[str] = None) ->
     await db.commit()
 
 
+@_read_only
 async def recent_logs(limit: int = 30) -> list[dict[str, Any]]:
     db = await get_db()
     cur = await db.execute(
@@ -630,17 +1840,3 @@ async def recent_logs(limit: int = 30) -> list[dict[str, Any]]:
     rows = await cur.fetchall()
     return [dict(r) for r in rows]
 
-
-# --- Backup ---
-
-
-async def export_db_blob() -> bytes:
-    """Return database file bytes for backup (non-blocking read)."""
-
-    def _read() -> bytes:
-        with open(DATABASE_PATH, "rb") as f:
-            return f.read()
-
-    import asyncio
-
-    return await asyncio.to_thread(_read)
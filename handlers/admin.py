@@ -2,8 +2,11 @@
 
 from __future__ import annotations
 
+import asyncio
 import logging
 import math
+import tempfile
+from pathlib import Path
 from typing import Any, Optional
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
@@ -19,17 +22,23 @@ from config import (
     ADMIN_ID,
     PAGE_SIZE_LECTURES,
     PAGE_SIZE_SUBJECTS,
-    BATCH_UPLOAD_PROGRESS_EVERY,
 )
-from handlers.common import track_user
+from handlers.common import get_request_state, request_stats
 from keyboards import admin as kb_admin
 from keyboards import user as kb_user
+from services import activity as activity_svc
+from services import backup as backup_svc
+from services import backlog as backlog_svc
 from services import broadcast as broadcast_svc
+from services import outbox as outbox_svc
 from services import upload as upload_svc
 from utils.helpers import title_from_document_filename
 
 logger = logging.getLogger(__name__)
 
+# Bot API getFile only serves files up to 20 MB.
+_BOT_DOWNLOAD_LIMIT = 20 * 1024 * 1024
+
 
 def _flow(context: ContextTypes.DEFAULT_TYPE) -> dict[str, Any]:
     return context.user_data.setdefault("admin_flow", {})
@@ -88,9 +97,8 @@ def _subjects_pick_keyboard(
 
 async def admin_text_router(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     u = update.effective_user
-    if not u or not await db.is_admin(u.id):
+    if not u or not (await get_request_state(update, context)).is_admin:
         return
-    await track_user(update)
     text = (update.effective_message.text or "").strip()
     if text == "⬅️ رجوع للمستخدم":
         _clear_flow(context)
@@ -158,6 +166,31 @@ async def admin_text_router(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     if text == "📥 رفع دفعة محاضرات":
         flow.clear()
+        session = await db.get_open_upload_session(u.id)
+        if session:
+            await update.effective_message.reply_text(
+                f"لديك رفع غير مكتمل لمادة «{session['subject_name']}» "
+                f"({session['staged']} ملف محفوظ).",
+                reply_markup=InlineKeyboardMarkup(
+                    [
+                        [
+                            InlineKeyboardButton(
+                                "▶️ متابعة", callback_data=f"bat|resume|{session['id']}"
+                            ),
+                            InlineKeyboardButton(
+                                "✅ إنهاء الرفع", callback_data=f"bat|done|{session['id']}"
+                            ),
+                        ],
+                        [
+                            InlineKeyboardButton(
+                                "❌ إلغاء", callback_data=f"bat|cancel|{session['id']}"
+                            ),
+                            InlineKeyboardButton("🆕 رفع جديد", callback_data="bat|new|0"),
+                        ],
+                    ]
+                ),
+            )
+            return
         flow["mode"] = "pick_batch_subject"
         total = await db.count_subjects()
         if total == 0:
@@ -197,17 +230,35 @@ async def admin_text_router(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
     if text == "📊 الإحصائيات":
+        await activity_svc.flush()
         u = await db.count_users()
         s = await db.count_subjects()
         l = await db.count_lectures_total()
         r = await db.count_requests()
-        await update.effective_message.reply_text(
+        reach = await db.reachability_stats()
+        cache = db.cache_stats()
+        req = request_stats()
+        out = outbox_svc.stats()
+        backlog = backlog_svc.last_stats
+        report = (
             "📊 الإحصائيات\n\n"
             f"👥 المستخدمون: {u}\n"
+            f"🚫 غير متاحين (حظروا البوت): {reach['unreachable']}\n"
             f"📚 المواد: {s}\n"
             f"📄 المحاضرات: {l}\n"
             f"📝 الطلبات: {r}\n"
+            f"🗄 ذاكرة الإعدادات: {cache['hits']} إصابة / {cache['misses']} إخفاق\n"
+            f"🔁 استعلامات القاعدة لكل تحديث: متوسط {req['avg_db_calls']:.2f}"
+            f" / أقصى {req['max_db_calls']}\n"
+            f"📤 طابور الإرسال: {sum(out['pending'].values())} في الانتظار"
+            f" (جماعي {out['pending']['BROADCAST']}), إعادة محاولة {out['retries']}\n"
         )
+        if backlog:
+            report += (
+                f"⏮ تحديثات فترة التوقف: {backlog.fetched} (تمت معالجة {backlog.processed}"
+                f"، مكرر {backlog.deduplicated}) في {backlog.drain_s:.1f} ث\n"
+            )
+        await update.effective_message.reply_text(report)
         return
 
     if text == "📢 رسالة جماعية":
@@ -228,15 +279,25 @@ async def admin_text_router(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
     if text == "📦 نسخ احتياطي":
-        data = await db.export_db_blob()
-        await update.effective_message.reply_document(
-            document=data,
-            filename="bot_backup.sqlite3",
-            caption="📦 نسخة احتياطية من قاعدة البيانات",
-        )
+        try:
+            await backup_svc.send_backup(context.bot, update.effective_chat.id)
+        except Exception:
+            logger.exception("Backup failed")
+            await update.effective_message.reply_text("❌ فشل إنشاء النسخة الاحتياطية.")
+            return
         await _log(update.effective_user.id, "backup", None)
         return
 
+    if text == "♻️ استعادة نسخة احتياطية":
+        flow.clear()
+        flow["mode"] = "restore_wait_file"
+        await update.effective_message.reply_text(
+            "أرسل ملف النسخة الاحتياطية (.sqlite3 أو .sqlite3.gz، حتى 20 ميجابايت).\n"
+            "⚠️ ستحل محل كل البيانات الحالية بعد التأكيد.",
+            reply_markup=kb_admin.admin_cancel_reply(),
+        )
+        return
+
     if text == "▶️ تشغيل البوت":
         await db.set_setting("bot_running", "1")
         await update.effective_message.reply_text("✅ تم تشغيل البوت للمستخدمين.")
@@ -314,17 +375,16 @@ async def admin_text_router(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
     if mode == "broadcast":
-        await update.effective_message.reply_text("⏳ جاري الإرسال...")
-        ok, fail = await broadcast_svc.send_broadcast_copy(
-            context,
+        bid = await broadcast_svc.start_broadcast_copy(
+            context.bot,
+            update.effective_user.id,
             update.effective_chat.id,
             update.effective_message.message_id,
         )
         await update.effective_message.reply_text(
-            f"✅ اكتمل الإرسال.\nنجاح: {ok}\nفشل: {fail}",
+            f"⏳ بدأ الإرسال الجماعي #{bid} في الخلفية.\nسيصلك تقرير عند الانتهاء.",
             reply_markup=kb_admin.admin_main_reply(),
         )
-        await _log(update.effective_user.id, "broadcast", f"ok={ok} fail={fail}")
         flow.clear()
         return
 
@@ -393,6 +453,58 @@ async def admin_text_router(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return
 
 
+async def cmd_recount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Rebuild the materialized counters from real COUNT(*)s and report drift."""
+    u = update.effective_user
+    if not u or not (await get_request_state(update, context)).is_admin:
+        await update.effective_message.reply_text("❌ غير مسموح لك بالوصول إلى لوحة الأدمن")
+        return
+    await activity_svc.flush()
+    drift = await db.recount_counters()
+    if not drift:
+        await update.effective_message.reply_text("✅ العدادات مطابقة، لا يوجد انحراف.")
+    else:
+        lines = [f"• {name}: {old} → {new}" for name, old, new in drift]
+        await update.effective_message.reply_text(
+            "🔧 تم إصلاح العدادات:\n" + "\n".join(lines[:50])
+        )
+    await _log(u.id, "recount", str(len(drift)))
+
+
+async def cmd_backups(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """List stored backup snapshots; ``/backups N`` sends snapshot N."""
+    u = update.effective_user
+    if not u or not (await get_request_state(update, context)).is_admin:
+        await update.effective_message.reply_text("❌ غير مسموح لك بالوصول إلى لوحة الأدمن")
+        return
+    snaps = await asyncio.to_thread(backup_svc.list_snapshots)
+    if context.args:
+        n = int(context.args[0]) if context.args[0].isdigit() else 0
+        if not 1 <= n <= len(snaps):
+            await update.effective_message.reply_text("❌ رقم النسخة غير صحيح.")
+            return
+        snap = snaps[n - 1]
+        await backup_svc.send_file(
+            context.bot,
+            update.effective_chat.id,
+            snap.path,
+            f"📦 نسخة احتياطية {snap.taken_at:%Y-%m-%d %H:%M} UTC",
+        )
+        await _log(u.id, "backup_send", snap.path.name)
+        return
+    lines = [
+        f"{i}. {s.taken_at:%Y-%m-%d %H:%M} UTC — {s.size / 1024 / 1024:.1f} MB"
+        + (" (قبل الاستعادة)" if s.pre_restore else "")
+        for i, s in enumerate(snaps, start=1)
+    ]
+    text = f"📦 النسخ الاحتياطية المحفوظة: {len(snaps)}\n\n" + "\n".join(lines[:60])
+    if backup_svc.last_run:
+        text += f"\n\nآخر تشغيل تلقائي: {backup_svc.last_run}"
+    if snaps:
+        text += "\n\nلإرسال نسخة: /backups رقم"
+    await update.effective_message.reply_text(text)
+
+
 async def _send_subject_pick(message, context: ContextTypes.DEFAULT_TYPE, prefix: str, page: int) -> None:
     total = await db.count_subjects()
     total_pages = max(1, math.ceil(total / PAGE_SIZE_SUBJECTS))
@@ -494,11 +606,10 @@ async def _show_links_menu(message, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def admin_callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     q = update.callback_query
     u = update.effective_user
-    if not u or not await db.is_admin(u.id):
+    if not u or not (await get_request_state(update, context)).is_admin:
         if q:
             await q.answer()
         return
-    await track_user(update)
     if not q:
         return
     await q.answer()
@@ -584,28 +695,12 @@ async def admin_callback_router(update: Update, context: ContextTypes.DEFAULT_TY
                 flow.clear()
                 flow["mode"] = "batch_collect"
                 flow["subject_id"] = sid
-                msg = await q.message.reply_text(
+                session_id = await upload_svc.start_batch(context.user_data, q.from_user.id, sid)
+                await _send_batch_controls(
+                    q.message,
+                    context,
+                    session_id,
                     "📥 أرسل الملفات واحدًا تلو الآخر. عند الانتهاء اضغط «✅ إنهاء الرفع» أو «❌ إلغاء».",
-                    reply_markup=InlineKeyboardMarkup(
-                        [
-                            [
-                                InlineKeyboardButton(
-                                    "✅ إنهاء الرفع",
-                                    callback_data=f"bat|done|{sid}",
-                                ),
-                                InlineKeyboardButton(
-                                    "❌ إلغاء",
-                                    callback_data=f"bat|cancel|{sid}",
-                                ),
-                            ]
-                        ]
-                    ),
-                )
-                upload_svc.start_batch(
-                    context.user_data,
-                    sid,
-                    q.message.chat_id,
-                    msg.message_id,
                 )
                 return
             if prefix == "dellecsub":
@@ -732,15 +827,65 @@ async def admin_callback_router(update: Update, context: ContextTypes.DEFAULT_TY
             await q.edit_message_text("أرسل الملف الجديد:")
             return
 
+    if parts[0] == "rst":
+        if flow.get("mode") != "restore_confirm":
+            await q.edit_message_text("لا توجد استعادة بانتظار التأكيد.")
+            return
+        _clear_flow(context)
+        if parts[1] == "cancel":
+            backup_svc.discard_prepared()
+            await q.edit_message_text("❌ تم إلغاء الاستعادة.")
+            return
+        await q.edit_message_text("⏳ جاري الاستعادة...")
+        try:
+            previous, swap_s = await backup_svc.restore_prepared()
+        except Exception as e:
+            logger.exception("Restore failed")
+            await q.edit_message_text(f"❌ فشلت الاستعادة:\n{e}")
+            return
+        saved = f"\nالبيانات السابقة محفوظة: {previous.path.name}" if previous else ""
+        await q.edit_message_text(
+            f"✅ تمت استعادة قاعدة البيانات خلال {swap_s * 1000:.0f} ms.{saved}"
+        )
+        await q.message.reply_text("لوحة الأدمن:", reply_markup=kb_admin.admin_main_reply())
+        await _log(uid, "restore", previous.path.name if previous else None)
+        return
+
     if parts[0] == "bat":
-        sid = int(parts[2])
+        session_id = int(parts[2])
         if parts[1] == "cancel":
-            upload_svc.cancel_batch(context.user_data)
+            await upload_svc.cancel_session(session_id)
+            upload_svc.clear_batch(context.user_data, session_id)
             _clear_flow(context)
             await q.edit_message_text("❌ تم إلغاء الرفع.")
             return
         if parts[1] == "done":
-            await _finalize_batch_upload(q, context, sid)
+            await _finalize_batch_upload(q, context, session_id)
+            return
+        if parts[1] == "resume":
+            session = await db.get_open_upload_session(q.from_user.id)
+            if not session or session["id"] != session_id:
+                await q.edit_message_text("لا يوجد رفع نشط.")
+                return
+            flow = _flow(context)
+            flow.clear()
+            flow["mode"] = "batch_collect"
+            flow["subject_id"] = session["subject_id"]
+            upload_svc.resume_batch(context.user_data, session)
+            await q.edit_message_text(f"▶️ متابعة الرفع لمادة «{session['subject_name']}».")
+            await _send_batch_controls(
+                q.message,
+                context,
+                session_id,
+                f"📥 تم استلام {session['staged']} ملفًا. أرسل بقية الملفات ثم اضغط «✅ إنهاء الرفع».",
+            )
+            return
+        if parts[1] == "new":
+            flow = _flow(context)
+            flow.clear()
+            flow["mode"] = "pick_batch_subject"
+            await q.edit_message_text("اختر المادة من الرسالة التالية:")
+            await _send_subject_pick(q.message, context, "batch", 0)
             return
 
     if parts[0] == "rsu":
@@ -1036,9 +1181,8 @@ async def _handle_lecture_pick_callback(
 
 async def admin_document_router(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     u = update.effective_user
-    if not u or not await db.is_admin(u.id):
+    if not u or not (await get_request_state(update, context)).is_admin:
         return
-    await track_user(update)
     doc = update.effective_message.document
     if not doc:
         return
@@ -1078,56 +1222,129 @@ async def admin_document_router(update: Update, context: ContextTypes.DEFAULT_TY
         await _log(update.effective_user.id, "replace_lecture_file", str(lid))
         flow.clear()
         return
+    if mode == "restore_wait_file":
+        await _receive_restore_file(update, context, flow)
+        return
     if mode == "batch_collect":
-        n = upload_svc.add_file_to_batch(
+        b = upload_svc.get_batch(context.user_data)
+        if not b:
+            return
+        edit = _batch_progress_editor(context, b)
+        msg = update.effective_message
+        if msg.media_group_id:
+            # Album members arrive as separate updates; stage them as one unit.
+            await upload_svc.add_album_file(
+                context.user_data,
+                msg.media_group_id,
+                doc.file_id,
+                doc.file_unique_id,
+                doc.file_name,
+                on_done=lambda n: upload_svc.report_progress(context.user_data, edit),
+            )
+            return
+        await upload_svc.add_file_to_batch(
             context.user_data,
             doc.file_id,
             doc.file_unique_id,
             doc.file_name,
         )
-        b = upload_svc.get_batch(context.user_data)
-        if b and n % BATCH_UPLOAD_PROGRESS_EVERY == 0:
-            try:
-                await context.bot.edit_message_text(
-                    chat_id=b["progress_chat_id"],
-                    message_id=b["progress_message_id"],
-                    text=f"📥 تم استلام {n} ملفًا...",
-                )
-            except Exception as e:
-                logger.debug("progress edit: %s", e)
+        await upload_svc.report_progress(context.user_data, edit)
 
 
-async def _finalize_batch_upload(q, context: ContextTypes.DEFAULT_TYPE, sid: int) -> None:
-    b = upload_svc.get_batch(context.user_data)
-    if not b:
-        await q.edit_message_text("لا يوجد رفع نشط.")
-        return
-    files = b["files"]
-    if upload_svc.is_batch_cancelled(context.user_data):
-        upload_svc.clear_batch(context.user_data)
-        await q.edit_message_text("تم الإلغاء سابقًا.")
+async def _receive_restore_file(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, flow: dict
+) -> None:
+    doc = update.effective_message.document
+    if doc.file_size and doc.file_size > _BOT_DOWNLOAD_LIMIT:
+        await update.effective_message.reply_text(
+            "❌ الملف أكبر من 20 ميجابايت (حد التنزيل للبوتات)."
+        )
         return
-    await q.edit_message_text(f"⏳ جاري رفع {len(files)} ملفًا...")
-    ok = 0
-    for i, f in enumerate(files):
-        if upload_svc.is_batch_cancelled(context.user_data):
-            break
+    status = await update.effective_message.reply_text("⏳ جاري فحص النسخة...")
+    with tempfile.TemporaryDirectory(prefix="bot_restore_") as tmp:
+        path = Path(tmp) / "upload"
+        tg_file = await doc.get_file()
+        await tg_file.download_to_drive(path)
+        try:
+            counts = await backup_svc.prepare_restore(path)
+        except backup_svc.BackupError as e:
+            await status.edit_text(f"❌ الملف ليس نسخة احتياطية صالحة:\n{e}")
+            return
+    flow["mode"] = "restore_confirm"
+    interrupted = (
+        f"📢 إرسال جماعي غير مكتمل في النسخة: {counts['interrupted_broadcasts']} "
+        "(لن يُستأنف بعد الاستعادة)\n\n"
+        if counts["interrupted_broadcasts"]
+        else ""
+    )
+    await status.edit_text(
+        "✅ النسخة سليمة:\n"
+        f"المواد: {counts['subjects']}\n"
+        f"المحاضرات: {counts['lectures']}\n"
+        f"المستخدمون: {counts['users']}\n"
+        f"اللينكات: {counts['links']}\n\n"
+        f"{interrupted}"
+        "ستُحفظ نسخة من البيانات الحالية قبل الاستعادة. هل تريد المتابعة؟",
+        reply_markup=kb_admin.confirm_restore_keyboard(),
+    )
+
+
+def _batch_controls_markup(session_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton("✅ إنهاء الرفع", callback_data=f"bat|done|{session_id}"),
+                InlineKeyboardButton("❌ إلغاء", callback_data=f"bat|cancel|{session_id}"),
+            ]
+        ]
+    )
+
+
+def _batch_progress_editor(context: ContextTypes.DEFAULT_TYPE, b: dict):
+    """Edit callback for upload_svc.report_progress; keeps the finish/cancel buttons."""
+
+    async def edit(n: int) -> None:
         try:
-            title = title_from_document_filename(f.get("file_name"))
-            await db.add_lecture(
-                sid,
-                title,
-                f["file_id"],
-                f.get("file_unique_id"),
-                f.get("file_name"),
+            await context.bot.edit_message_text(
+                chat_id=b["progress_chat_id"],
+                message_id=b["progress_message_id"],
+                text=f"📥 تم استلام {n} ملفًا...",
+                reply_markup=_batch_controls_markup(b["session_id"]),
             )
-            ok += 1
         except Exception as e:
-            logger.warning("batch item failed: %s", e)
-    upload_svc.clear_batch(context.user_data)
+            logger.debug("progress edit: %s", e)
+
+    return edit
+
+
+async def _send_batch_controls(
+    message, context: ContextTypes.DEFAULT_TYPE, session_id: int, text: str
+) -> None:
+    msg = await message.reply_text(text, reply_markup=_batch_controls_markup(session_id))
+    await upload_svc.set_progress_message(context.user_data, msg.chat_id, msg.message_id)
+
+
+async def _finalize_batch_upload(
+    q, context: ContextTypes.DEFAULT_TYPE, session_id: int
+) -> None:
+    await q.edit_message_text("⏳ جاري حفظ الملفات...")
+    result = await upload_svc.finish_session(session_id)
+    upload_svc.clear_batch(context.user_data, session_id)
     _clear_flow(context)
-    await q.message.reply_text(
-        f"✅ اكتمل الرفع. تمت إضافة {ok} محاضرة.",
-        reply_markup=kb_admin.admin_main_reply(),
+    if result is None:
+        await q.edit_message_text("لا يوجد رفع نشط.")
+        return
+    text = f"✅ اكتمل الرفع. تمت إضافة {result.added} محاضرة."
+    if result.failed:
+        # seq is the 0-based arrival position; admins count files from 1.
+        numbers = "، ".join(str(seq + 1) for seq in sorted(result.failed)[:20])
+        more = "…" if len(result.failed) > 20 else ""
+        text += f"\n⚠️ تعذر حفظ {len(result.failed)} ملف (بترتيب الإرسال: {numbers}{more})."
+        for seq, reason in sorted(result.failed.items()):
+            logger.warning("Upload session %d: seq %d not saved: %s", session_id, seq, reason)
+    await q.message.reply_text(text, reply_markup=kb_admin.admin_main_reply())
+    await _log(
+        q.from_user.id,
+        "batch_upload",
+        f"{result.added} failed={len(result.failed)}" if result.failed else str(result.added),
     )
-    await _log(q.from_user.id, "batch_upload", str(ok))
@@ -5,10 +5,14 @@ from __future__ import annotations
 import logging
 import time
 import traceback
+from dataclasses import dataclass
+from typing import Optional
+
 from telegram import Update
 from telegram.ext import ContextTypes
 
 import db
+from services import activity as activity_svc
 
 logger = logging.getLogger(__name__)
 
@@ -81,20 +85,72 @@ async def track_user(update: Update) -> None:
     u = update.effective_user
     if not u:
         return
-    await db.upsert_user(u.id, u.username, u.first_name)
+    await activity_svc.record(u.id, u.username, u.first_name)
 
 
-async def user_bot_accessible(update: Update) -> bool:
-    """False if bot is stopped and user is not admin."""
+@dataclass(frozen=True)
+class RequestState:
+    """Who sent the current update, resolved once per update."""
+
+    user_id: Optional[int]
+    is_admin: bool
+    bot_running: bool
+
+
+# Totals for the DB-calls-per-update metric (see report_request_stats).
+_updates_seen = 0
+_db_calls_total = 0
+_db_calls_max = 0
+
+
+async def resolve_request_state(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Group -1 middleware: track the user and resolve admin/running state once."""
+    context.db_calls = db.count_calls()
+    if not isinstance(update, Update):
+        return
+    if update.my_chat_member is None:
+        # Block/unblock events are not activity (see user.on_my_chat_member).
+        await track_user(update)
     u = update.effective_user
-    if not u:
+    context.request_state = RequestState(
+        user_id=u.id if u else None,
+        is_admin=bool(u) and await db.is_admin(u.id),
+        bot_running=await db.is_bot_running(),
+    )
+
+
+async def get_request_state(update: Update, context: ContextTypes.DEFAULT_TYPE) -> RequestState:
+    state = getattr(context, "request_state", None)
+    if state is None:
+        # Not routed through the middleware (e.g. called directly); resolve now.
+        await resolve_request_state(update, context)
+        state = context.request_state
+    return state
+
+
+async def report_request_stats(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Last-group handler: record how many DB calls the update cost."""
+    global _updates_seen, _db_calls_total, _db_calls_max
+    counter = getattr(context, "db_calls", None)
+    if counter is None:
+        return
+    _updates_seen += 1
+    _db_calls_total += counter.count
+    _db_calls_max = max(_db_calls_max, counter.count)
+    logger.debug("Update handled with %d DB call(s)", counter.count)
+
+
+def request_stats() -> dict[str, float]:
+    avg = _db_calls_total / _updates_seen if _updates_seen else 0.0
+    return {"updates": _updates_seen, "avg_db_calls": avg, "max_db_calls": _db_calls_max}
+
+
+async def user_bot_accessible(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """False if bot is stopped and user is not admin."""
+    if not update.effective_user:
         return False
-    await track_user(update)
-    if await db.is_bot_running():
-        return True
-    if await db.is_admin(u.id):
-        return True
-    return False
+    state = await get_request_state(update, context)
+    return state.bot_running or state.is_admin
 
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -3,10 +3,9 @@
 from __future__ import annotations
 
 import logging
-import math
-from typing import Optional
+from typing import Any, Optional
 
-from telegram import Update
+from telegram import ChatMember, Update
 from telegram.ext import (
     CommandHandler,
     ContextTypes,
@@ -29,12 +28,15 @@ from handlers.common import (
     ST_SEARCH,
     should_ignore_duplicate_callback,
     should_ignore_duplicate_command,
-    track_user,
+    get_request_state,
     user_bot_accessible,
 )
 from keyboards import admin as kb_admin
 from keyboards import user as kb_user
+from services import catalog as catalog_svc
+from services import download as download_svc
 from services import search as search_svc
+from utils.helpers import parse_seek_cursor
 
 logger = logging.getLogger(__name__)
 
@@ -46,16 +48,38 @@ async def _send_main_menu(message, context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
 
+def _seek_kwargs(
+    cursor: Optional[tuple[str, str, str]],
+    page: int,
+    page_size: int,
+    key_type: type = int,
+) -> dict[str, Any]:
+    """Keyword args for the *_page listing functions from a parsed pagination callback."""
+    if not cursor:
+        # No cursor: first page, or a plain page number from an older keyboard.
+        return {"offset": page * page_size}
+    key = (key_type(cursor[1]), int(cursor[2]))
+    return {"after": key} if cursor[0] == "a" else {"before": key}
+
+
 async def render_subjects(
     context: ContextTypes.DEFAULT_TYPE,
     page: int,
     *,
+    cursor: Optional[tuple[str, str, str]] = None,
     edit_query=None,
     reply_message=None,
 ) -> None:
-    """Single entry point for subjects list (commands, text, callbacks)."""
-    total = await db.count_subjects()
-    if total == 0:
+    """Single entry point for subjects list (commands, text, callbacks).
+
+    ``cursor`` is the keyset cursor from a pagination callback (see
+    utils.helpers.seek_callback); ``page`` is then only the displayed number.
+    """
+    cat = await catalog_svc.current()
+    result = cat.subjects_page(
+        page, PAGE_SIZE_SUBJECTS, **_seek_kwargs(cursor, page, PAGE_SIZE_SUBJECTS)
+    )
+    if result.total == 0:
         text = "لا توجد مواد بعد."
         kb = kb_user.main_menu_reply()
         if edit_query:
@@ -63,12 +87,8 @@ async def render_subjects(
         elif reply_message:
             await reply_message.reply_text(text, reply_markup=kb)
         return
-    total_pages = max(1, math.ceil(total / PAGE_SIZE_SUBJECTS))
-    page = max(0, min(page, total_pages - 1))
-    offset = page * PAGE_SIZE_SUBJECTS
-    rows = await db.list_subjects_page(offset, PAGE_SIZE_SUBJECTS)
     text = "📚 المواد — اختر المادة:"
-    markup = kb_user.subjects_page_keyboard(rows, page, total_pages)
+    markup = kb_user.subjects_page_keyboard(result.rows, result.page, result.total_pages)
     if edit_query:
         await edit_query.edit_message_text(text, reply_markup=markup)
     elif reply_message:
@@ -79,8 +99,7 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     u = update.effective_user
     if u and should_ignore_duplicate_command(context.application.bot_data, u.id, "start"):
         return ConversationHandler.END
-    await track_user(update)
-    if not await user_bot_accessible(update):
+    if not await user_bot_accessible(update, context):
         await update.effective_message.reply_text(
             "⏹ البوت متوقف حاليًا. حاول لاحقًا."
         )
@@ -93,8 +112,7 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     u = update.effective_user
     if u and should_ignore_duplicate_command(context.application.bot_data, u.id, "help"):
         return
-    await track_user(update)
-    if not await user_bot_accessible(update):
+    if not await user_bot_accessible(update, context):
         await update.effective_message.reply_text("⏹ البوت متوقف حاليًا.")
         return
     await update.effective_message.reply_text(
@@ -112,8 +130,7 @@ async def cmd_subjects(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     u = update.effective_user
     if u and should_ignore_duplicate_command(context.application.bot_data, u.id, "subjects"):
         return
-    await track_user(update)
-    if not await user_bot_accessible(update):
+    if not await user_bot_accessible(update, context):
         await update.effective_message.reply_text("⏹ البوت متوقف حاليًا.")
         return
     await render_subjects(context, 0, reply_message=update.effective_message)
@@ -123,8 +140,7 @@ async def cmd_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     u = update.effective_user
     if u and should_ignore_duplicate_command(context.application.bot_data, u.id, "search"):
         return ConversationHandler.END
-    await track_user(update)
-    if not await user_bot_accessible(update):
+    if not await user_bot_accessible(update, context):
         await update.effective_message.reply_text("⏹ البوت متوقف حاليًا.")
         return ConversationHandler.END
     await update.effective_message.reply_text(
@@ -138,10 +154,9 @@ async def cmd_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     u = update.effective_user
     if u and should_ignore_duplicate_command(context.application.bot_data, u.id, "admin"):
         return
-    await track_user(update)
     if not u:
         return
-    if await db.is_admin(u.id):
+    if (await get_request_state(update, context)).is_admin:
         await update.effective_message.reply_text(
             "لوحة الأدمن:",
             reply_markup=kb_admin.admin_main_reply(),
@@ -157,37 +172,39 @@ async def show_lectures_for_subject(
     context: ContextTypes.DEFAULT_TYPE,
     subject_id: int,
     page: int,
+    cursor: Optional[tuple[str, str, str]] = None,
 ) -> None:
-    sub = await db.get_subject(subject_id)
+    cat = await catalog_svc.current()
+    sub = cat.subject(subject_id)
     if not sub:
         await query.edit_message_text(
             "المادة غير موجودة.",
             reply_markup=kb_user.main_menu_reply(),
         )
         return
-    total = await db.count_lectures_in_subject(subject_id)
-    if total == 0:
+    result = cat.lectures_page(
+        subject_id,
+        page,
+        PAGE_SIZE_LECTURES,
+        **_seek_kwargs(cursor, page, PAGE_SIZE_LECTURES),
+    )
+    if result.total == 0:
         await query.edit_message_text(
             f"📂 {sub['name']}\n\nلا توجد محاضرات بعد.",
             reply_markup=kb_user.lectures_page_keyboard([], subject_id, 0, 1),
         )
         return
-    total_pages = max(1, math.ceil(total / PAGE_SIZE_LECTURES))
-    page = max(0, min(page, total_pages - 1))
-    offset = page * PAGE_SIZE_LECTURES
-    lectures = await db.list_lectures_page(subject_id, offset, PAGE_SIZE_LECTURES)
     text = f"📂 {sub['name']}\n\nاختر المحاضرة:"
     await query.edit_message_text(
         text,
         reply_markup=kb_user.lectures_page_keyboard(
-            lectures, subject_id, page, total_pages
+            result.rows, subject_id, result.page, result.total_pages
         ),
     )
 
 
 async def user_text_router(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Optional[int]:
-    await track_user(update)
-    if not await user_bot_accessible(update):
+    if not await user_bot_accessible(update, context):
         await update.effective_message.reply_text("⏹ البوت متوقف حاليًا.")
         return None
     text = (update.effective_message.text or "").strip()
@@ -205,7 +222,7 @@ async def user_text_router(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         await show_latest_page(update.effective_message, context, page=0, new_msg=True)
         return ConversationHandler.END
     if text == "🔗 لينكات مهمة":
-        links = await db.list_links()
+        links = (await catalog_svc.current()).links
         if not links:
             await update.effective_message.reply_text(
                 "لا توجد لينكات بعد.",
@@ -226,21 +243,21 @@ async def show_latest_page(
     context: ContextTypes.DEFAULT_TYPE,
     page: int,
     new_msg: bool,
+    cursor: Optional[tuple[str, str, str]] = None,
 ) -> None:
-    total = await db.count_latest_lectures()
-    if total == 0:
+    cat = await catalog_svc.current()
+    result = cat.latest_page(
+        page, PAGE_SIZE_SEARCH, **_seek_kwargs(cursor, page, PAGE_SIZE_SEARCH, str)
+    )
+    if result.total == 0:
         text = "لا توجد محاضرات بعد."
         if new_msg:
             await message.reply_text(text, reply_markup=kb_user.main_menu_reply())
         else:
             await message.edit_text(text, reply_markup=kb_user.main_menu_reply())
         return
-    total_pages = max(1, math.ceil(total / PAGE_SIZE_SEARCH))
-    page = max(0, min(page, total_pages - 1))
-    offset = page * PAGE_SIZE_SEARCH
-    rows = await db.latest_lectures_page(offset, PAGE_SIZE_SEARCH)
     text = "🆕 أحدث المحاضرات:"
-    markup = kb_user.latest_keyboard(rows, page, total_pages)
+    markup = kb_user.latest_keyboard(result.rows, result.page, result.total_pages)
     if new_msg:
         await message.reply_text(text, reply_markup=markup)
     else:
@@ -248,15 +265,14 @@ async def show_latest_page(
 
 
 async def conv_search_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await track_user(update)
-    if not await user_bot_accessible(update):
+    if not await user_bot_accessible(update, context):
         return ConversationHandler.END
     q = (update.effective_message.text or "").strip()
     if q in ("⬅️ رجوع", "🏠 الرئيسية"):
         await _send_main_menu(update.effective_message, context)
         return ConversationHandler.END
-    rows, total, total_pages = await search_svc.search_page(q, 0)
-    if total == 0:
+    result = await search_svc.search_page(q, 0)
+    if result.total == 0:
         await update.effective_message.reply_text(
             "لا توجد نتائج.",
             reply_markup=kb_user.main_menu_reply(),
@@ -265,14 +281,15 @@ async def conv_search_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     context.user_data["last_search_query"] = q
     await update.effective_message.reply_text(
         f"🔎 نتائج البحث عن: {q}",
-        reply_markup=kb_user.search_results_keyboard(rows, 0, total_pages),
+        reply_markup=kb_user.search_results_keyboard(
+            result.rows, result.page, result.total_pages
+        ),
     )
     return ConversationHandler.END
 
 
 async def conv_request_subject(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await track_user(update)
-    if not await user_bot_accessible(update):
+    if not await user_bot_accessible(update, context):
         return ConversationHandler.END
     t = (update.effective_message.text or "").strip()
     if t in ("⬅️ رجوع", "🏠 الرئيسية"):
@@ -287,8 +304,7 @@ async def conv_request_subject(update: Update, context: ContextTypes.DEFAULT_TYP
 
 
 async def conv_request_lecture(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await track_user(update)
-    if not await user_bot_accessible(update):
+    if not await user_bot_accessible(update, context):
         return ConversationHandler.END
     t = (update.effective_message.text or "").strip()
     if t in ("⬅️ رجوع", "🏠 الرئيسية"):
@@ -315,8 +331,7 @@ async def conv_request_lecture(update: Update, context: ContextTypes.DEFAULT_TYP
 
 
 async def conv_contact_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await track_user(update)
-    if not await user_bot_accessible(update):
+    if not await user_bot_accessible(update, context):
         return ConversationHandler.END
     if (update.effective_message.text or "").strip() in ("⬅️ رجوع", "🏠 الرئيسية"):
         await _send_main_menu(update.effective_message, context)
@@ -340,7 +355,6 @@ async def conv_contact_message(update: Update, context: ContextTypes.DEFAULT_TYP
 
 
 async def user_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await track_user(update)
     q = update.callback_query
     if not q:
         return
@@ -350,7 +364,7 @@ async def user_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         await q.answer()
         return
 
-    if not await user_bot_accessible(update):
+    if not await user_bot_accessible(update, context):
         await q.answer()
         await q.message.reply_text("⏹ البوت متوقف حاليًا.")
         return
@@ -372,7 +386,9 @@ async def user_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     if parts[0] == "usub":
         if parts[1] == "page":
             page = int(parts[2])
-            await render_subjects(context, page, edit_query=q)
+            await render_subjects(
+                context, page, cursor=parse_seek_cursor(parts[3:]), edit_query=q
+            )
         elif parts[1] == "open":
             sid = int(parts[2])
             await show_lectures_for_subject(q, context, sid, 0)
@@ -381,11 +397,13 @@ async def user_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         if parts[1] == "page":
             sid = int(parts[2])
             page = int(parts[3])
-            await show_lectures_for_subject(q, context, sid, page)
+            await show_lectures_for_subject(
+                q, context, sid, page, cursor=parse_seek_cursor(parts[4:])
+            )
         elif parts[1] == "open":
             lid = int(parts[2])
             sid = int(parts[3])
-            lec = await db.get_lecture(lid)
+            lec = (await catalog_svc.current()).lecture(lid)
             if not lec or lec["subject_id"] != sid:
                 await q.message.reply_text("المحاضرة غير موجودة.")
                 return
@@ -400,20 +418,12 @@ async def user_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
                 await q.message.reply_text("تعذر إرسال الملف.")
         elif parts[1] == "all":
             sid = int(parts[2])
-            lecs = await db.list_all_lectures_in_subject(sid)
+            lecs = (await catalog_svc.current()).lectures_in_subject(sid)
             if not lecs:
                 await q.message.reply_text("لا توجد ملفات.")
                 return
-            await q.message.reply_text(f"📥 جاري إرسال {len(lecs)} ملفًا...")
-            for lec in lecs:
-                try:
-                    await context.bot.send_document(
-                        chat_id=q.message.chat_id,
-                        document=lec["file_id"],
-                        caption=f"📄 {lec['title']}",
-                    )
-                except Exception as e:
-                    logger.warning("bulk send failed: %s", e)
+            if not download_svc.start(context.bot, q.message.chat_id, lecs):
+                await q.message.reply_text("⏳ جاري إرسال الملفات بالفعل، انتظر حتى ينتهي.")
 
     elif parts[0] == "usea":
         query_text = context.user_data.get("last_search_query")
@@ -422,20 +432,23 @@ async def user_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             return
         if parts[1] == "page":
             page = int(parts[2])
-            rows, total, total_pages = await search_svc.search_page(query_text, page)
+            result = await search_svc.search_page(query_text, page)
             await q.edit_message_text(
                 f"🔎 نتائج البحث عن: {query_text}",
-                reply_markup=kb_user.search_results_keyboard(rows, page, total_pages),
+                reply_markup=kb_user.search_results_keyboard(
+                    result.rows, result.page, result.total_pages
+                ),
             )
 
     elif parts[0] == "ulate":
         page = int(parts[2])
-        await show_latest_page(q.message, context, page, new_msg=False)
+        await show_latest_page(
+            q.message, context, page, new_msg=False, cursor=parse_seek_cursor(parts[3:])
+        )
 
 
 async def entry_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await track_user(update)
-    if not await user_bot_accessible(update):
+    if not await user_bot_accessible(update, context):
         return ConversationHandler.END
     await update.effective_message.reply_text(
         "📝 اكتب اسم المادة في رسالة واحدة:",
@@ -445,8 +458,7 @@ async def entry_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
 
 
 async def entry_contact(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await track_user(update)
-    if not await user_bot_accessible(update):
+    if not await user_bot_accessible(update, context):
         return ConversationHandler.END
     await update.effective_message.reply_text(
         "👤 اكتب رسالتك للأدمن في الرسالة التالية:",
@@ -459,6 +471,16 @@ async def fallback_home(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     return await cmd_start(update, context)
 
 
+async def on_my_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Keep users.blocked_at in sync when a user blocks or restarts the bot."""
+    change = update.my_chat_member
+    if not change or change.chat.type != "private":
+        return
+    status = change.new_chat_member.status
+    blocked = status in (ChatMember.BANNED, ChatMember.LEFT)
+    await db.set_user_blocked(change.chat.id, blocked)
+
+
 def build_user_conversation() -> ConversationHandler:
     return ConversationHandler(
         entry_points=[
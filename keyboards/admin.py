@@ -22,6 +22,7 @@ def admin_main_reply() -> ReplyKeyboardMarkup:
             [KeyboardButton("👮 إدارة الأدمنز")],
             [KeyboardButton("🔗 إدارة اللينكات")],
             [KeyboardButton("📦 نسخ احتياطي")],
+            [KeyboardButton("♻️ استعادة نسخة احتياطية")],
             [KeyboardButton("▶️ تشغيل البوت")],
             [KeyboardButton("⏹ إيقاف البوت")],
             [KeyboardButton("📝 سجل الأدمن")],
@@ -40,6 +41,17 @@ def admin_cancel_reply() -> ReplyKeyboardMarkup:
     )
 
 
+def confirm_restore_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton("✅ تأكيد الاستعادة", callback_data="rst|go"),
+                InlineKeyboardButton("❌ إلغاء", callback_data="rst|cancel"),
+            ]
+        ]
+    )
+
+
 def confirm_delete_lecture_keyboard(lecture_id: int, subject_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -4,6 +4,8 @@ from __future__ import annotations
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
 
+from utils.helpers import seek_callback
+
 
 def main_menu_reply() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
@@ -53,17 +55,27 @@ def subjects_page_keyboard(
     nav = []
     if total_pages > 1:
         if page > 0:
-            nav.append(
-                InlineKeyboardButton("◀️ السابق", callback_data=f"usub|page|{page - 1}")
+            first = subjects[0]
+            prev_cb = (
+                "usub|page|0"
+                if page == 1
+                else seek_callback("usub|page", page - 1, "b", (first["sort_order"], first["id"]))
             )
+            nav.append(InlineKeyboardButton("◀️ السابق", callback_data=prev_cb))
         nav.append(
             InlineKeyboardButton(
                 f"{page + 1}/{total_pages}", callback_data="noop"
             )
         )
         if page < total_pages - 1:
+            last = subjects[-1]
             nav.append(
-                InlineKeyboardButton("التالي ▶️", callback_data=f"usub|page|{page + 1}")
+                InlineKeyboardButton(
+                    "التالي ▶️",
+                    callback_data=seek_callback(
+                        "usub|page", page + 1, "a", (last["sort_order"], last["id"])
+                    ),
+                )
             )
     if nav:
         rows.append(nav)
@@ -91,20 +103,32 @@ def lectures_page_keyboard(
     nav = []
     if total_pages > 1:
         if page > 0:
-            nav.append(
-                InlineKeyboardButton(
-                    "◀️ السابق",
-                    callback_data=f"ulec|page|{subject_id}|{page - 1}",
+            first = lectures[0]
+            prev_cb = (
+                f"ulec|page|{subject_id}|0"
+                if page == 1
+                else seek_callback(
+                    f"ulec|page|{subject_id}",
+                    page - 1,
+                    "b",
+                    (first["sort_order"], first["id"]),
                 )
             )
+            nav.append(InlineKeyboardButton("◀️ السابق", callback_data=prev_cb))
         nav.append(
             InlineKeyboardButton(f"{page + 1}/{total_pages}", callback_data="noop")
         )
         if page < total_pages - 1:
+            last = lectures[-1]
             nav.append(
                 InlineKeyboardButton(
                     "التالي ▶️",
-                    callback_data=f"ulec|page|{subject_id}|{page + 1}",
+                    callback_data=seek_callback(
+                        f"ulec|page|{subject_id}",
+                        page + 1,
+                        "a",
+                        (last["sort_order"], last["id"]),
+                    ),
                 )
             )
     if nav:
@@ -189,18 +213,26 @@ def latest_keyboard(
     nav = []
     if total_pages > 1:
         if page > 0:
-            nav.append(
-                InlineKeyboardButton(
-                    "◀️ السابق", callback_data=f"ulate|page|{page - 1}"
+            first = items[0]
+            prev_cb = (
+                "ulate|page|0"
+                if page == 1
+                else seek_callback(
+                    "ulate|page", page - 1, "b", (first["created_at"], first["id"])
                 )
             )
+            nav.append(InlineKeyboardButton("◀️ السابق", callback_data=prev_cb))
         nav.append(
             InlineKeyboardButton(f"{page + 1}/{total_pages}", callback_data="noop")
         )
         if page < total_pages - 1:
+            last = items[-1]
             nav.append(
                 InlineKeyboardButton(
-                    "التالي ▶️", callback_data=f"ulate|page|{page + 1}"
+                    "التالي ▶️",
+                    callback_data=seek_callback(
+                        "ulate|page", page + 1, "a", (last["created_at"], last["id"])
+                    ),
                 )
             )
     if nav:
@@ -0,0 +1,59 @@
+"""Write-behind buffer for user activity (one transaction per flush, not per update)."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from telegram.ext import ContextTypes
+
+import db
+from config import USER_ACTIVITY_FLUSH_MAX
+
+logger = logging.getLogger(__name__)
+
+# user_id -> (username, first_name, first_seen, last_seen)
+_pending: dict[int, tuple[Optional[str], Optional[str], str, str]] = {}
+_flush_lock = asyncio.Lock()
+
+
+async def record(user_id: int, username: Optional[str], first_name: Optional[str]) -> None:
+    """Remember a sighting of a user; repeat sightings collapse into one row."""
+    now = datetime.now(timezone.utc).isoformat()
+    prev = _pending.get(user_id)
+    first_seen = prev[2] if prev else now
+    _pending[user_id] = (username, first_name, first_seen, now)
+    if len(_pending) >= USER_ACTIVITY_FLUSH_MAX:
+        await flush()
+
+
+async def flush() -> int:
+    """Write all pending sightings in a single transaction. Returns rows written."""
+    global _pending
+    async with _flush_lock:
+        if not _pending:
+            return 0
+        batch, _pending = _pending, {}
+        rows = [
+            (uid, username, first_name, first_seen, last_seen)
+            for uid, (username, first_name, first_seen, last_seen) in batch.items()
+        ]
+        try:
+            await db.upsert_users_bulk(rows)
+        except Exception as e:
+            logger.warning("User activity flush failed (%d rows): %s", len(rows), e)
+            # Put the batch back without clobbering sightings recorded meanwhile.
+            for uid, entry in batch.items():
+                newer = _pending.get(uid)
+                if newer is None:
+                    _pending[uid] = entry
+                else:
+                    _pending[uid] = (newer[0], newer[1], entry[2], newer[3])
+            return 0
+        return len(rows)
+
+
+async def flush_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await flush()
@@ -0,0 +1,135 @@
+"""Startup catch-up: process updates that arrived while the bot was down.
+
+Runs from post_init in polling mode, before polling starts. Pending updates are
+fetched with getUpdates one batch at a time. In each batch stale callback presses
+are dropped (only the newest press per user and message is kept), and the rest go
+through the update processor, which runs them concurrently while keeping each
+user's order. A batch is acknowledged only by the getUpdates call for the next
+one, after it was processed, so a crash mid-drain re-delivers the unfinished
+batch instead of losing it.
+
+Conflict (another getUpdates consumer, e.g. the previous process still shutting
+down) and network errors are retried with backoff. If the drain still fails it
+is abandoned with a warning and startup continues: whatever was not yet
+acknowledged stays pending and normal polling picks it up.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from telegram import Update
+from telegram.error import Conflict, NetworkError, TelegramError
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+_FETCH_LIMIT = 100
+_RETRY_ATTEMPTS = 5
+_RETRY_BASE_S = 1.0
+
+_T = TypeVar("_T")
+
+
+@dataclass(frozen=True)
+class BacklogStats:
+    fetched: int
+    processed: int
+    deduplicated: int
+    drain_s: float
+
+
+last_stats: Optional[BacklogStats] = None
+
+
+def _callback_key(update: Update) -> Optional[tuple[int, int, int]]:
+    q = update.callback_query
+    if q is None or q.message is None:
+        return None
+    return q.from_user.id, q.message.chat.id, q.message.message_id
+
+
+def dedupe(updates: list[Update]) -> list[Update]:
+    """Keep arrival order; of several presses on one message by one user keep the last."""
+    latest: dict[tuple[int, int, int], int] = {}
+    for u in updates:
+        key = _callback_key(u)
+        if key is not None:
+            latest[key] = u.update_id
+    return [
+        u for u in updates if (key := _callback_key(u)) is None or latest[key] == u.update_id
+    ]
+
+
+async def _process(application: Application, updates: list[Update]) -> None:
+    processor = application.update_processor
+    # Tasks are created in update order; the processor keeps per-user order.
+    results = await asyncio.gather(
+        *(processor.process_update(u, application.process_update(u)) for u in updates),
+        return_exceptions=True,
+    )
+    for u, res in zip(updates, results):
+        if isinstance(res, Exception):
+            logger.warning("Backlog update %s failed: %s", u.update_id, res)
+
+
+async def _retrying(call: Callable[[], Awaitable[_T]]) -> _T:
+    """Run a Bot API call, backing off on Conflict and network errors."""
+    delay = _RETRY_BASE_S
+    for attempt in range(1, _RETRY_ATTEMPTS + 1):
+        try:
+            return await call()
+        except (Conflict, NetworkError) as e:
+            if attempt == _RETRY_ATTEMPTS:
+                raise
+            logger.info("Backlog fetch failed (%s), retrying in %.0fs", e, delay)
+            await asyncio.sleep(delay)
+            delay *= 2
+    raise AssertionError("unreachable")
+
+
+async def drain(application: Application) -> BacklogStats:
+    """Process the pending backlog and acknowledge it. Call before polling starts."""
+    global last_stats
+    start = time.perf_counter()
+    bot = application.bot
+    fetched = processed = 0
+    offset: Optional[int] = None
+    try:
+        # getUpdates is refused while a webhook is set; keep its pending updates.
+        await _retrying(lambda: bot.delete_webhook(drop_pending_updates=False))
+        while True:
+            # Passing the offset confirms the previous batch, which is processed by now.
+            batch = await _retrying(
+                lambda: bot.get_updates(offset=offset, limit=_FETCH_LIMIT, timeout=0)
+            )
+            if not batch:
+                break
+            kept = dedupe(batch)
+            await _process(application, kept)
+            fetched += len(batch)
+            processed += len(kept)
+            offset = batch[-1].update_id + 1
+    except TelegramError as e:
+        # Unacknowledged updates stay pending; polling delivers them (the last
+        # processed batch may be delivered again).
+        logger.warning("Backlog drain abandoned, continuing with polling: %s", e)
+
+    last_stats = BacklogStats(
+        fetched=fetched,
+        processed=processed,
+        deduplicated=fetched - processed,
+        drain_s=time.perf_counter() - start,
+    )
+    logger.info(
+        "Backlog drained: %d pending, %d processed, %d stale callbacks dropped in %.2fs",
+        last_stats.fetched,
+        last_stats.processed,
+        last_stats.deduplicated,
+        last_stats.drain_s,
+    )
+    return last_stats
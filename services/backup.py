@@ -0,0 +1,410 @@
+"""Database backups: online, WAL-consistent snapshots, gzip-compressed on disk.
+
+The snapshot is taken with SQLite's backup API from a separate connection, so it
+includes committed data still in the ``-wal`` file and never blocks the bot's
+writer (WAL readers do not block writers). Compression streams in fixed-size
+chunks and documents are uploaded from the file handle, so memory use does not
+grow with the database. Archives larger than ``BACKUP_PART_BYTES`` are sent as
+numbered parts; ``cat`` the parts back together to get the ``.gz`` file.
+
+Every snapshot must pass ``PRAGMA integrity_check`` before it is kept or sent.
+``backup_job`` stores snapshots in ``BACKUP_DIR`` on a schedule: one per hour
+is kept for ``BACKUP_KEEP_HOURLY_H`` hours, one per day for ``BACKUP_KEEP_DAILY_D``
+days. A run is skipped when nothing was written since the previous snapshot.
+
+Restoring is two steps: ``prepare_restore`` decompresses an uploaded backup next
+to the database, validates it and runs the schema migrations on it
+(``db.check_database``); ``restore_prepared`` saves a ``pre_restore-`` snapshot
+of the current data (kept until deleted by hand, never by retention), then swaps
+the file in with ``db.replace_database``. Broadcasts the backup
+caught mid-run are marked ``interrupted`` rather than resumed: their recipients
+since the snapshot already got the message.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import gzip
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+
+from telegram import InputFile
+from telegram.ext import ContextTypes, ExtBot
+
+import db
+from config import (
+    ADMIN_ID,
+    BACKUP_DIR,
+    BACKUP_KEEP_DAILY_D,
+    BACKUP_KEEP_HOURLY_H,
+    BACKUP_PART_BYTES,
+    DATABASE_PATH,
+)
+from services import broadcast as broadcast_svc
+from services import catalog as catalog_svc
+from services import upload as upload_svc
+from services.outbox import Priority
+
+logger = logging.getLogger(__name__)
+
+_CHUNK = 1024 * 1024
+# Large documents need more than PTB's default write timeout.
+_UPLOAD_TIMEOUT_S = 300
+# Tables (and columns) a restored file must have; newer columns are added by init_db.
+_REQUIRED_SCHEMA = {
+    "users": {"user_id", "username", "first_name"},
+    "subjects": {"id", "name", "sort_order"},
+    "lectures": {"id", "subject_id", "title", "file_id", "sort_order"},
+    "links": {"id", "title", "url"},
+    "admins": {"user_id"},
+    "settings": {"key", "value"},
+}
+_NAME_RE = re.compile(r"^(bot_backup|pre_restore)-(\d{8}-\d{6})\.sqlite3\.gz$")
+# Prefix of the snapshot restore_prepared takes of the data it replaces; retention
+# never deletes these.
+_PRE_RESTORE = "pre_restore"
+
+# db.total_changes() when the last scheduled snapshot was taken.
+_changes_at_last_backup: Optional[int] = None
+last_run: Optional[str] = None  # outcome of the last backup_job, for /backups
+
+
+class BackupError(Exception):
+    """The snapshot failed verification."""
+
+
+@dataclass(frozen=True)
+class Backup:
+    path: Path
+    raw_size: int  # bytes of the SQLite snapshot
+    size: int  # bytes of the compressed archive
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    path: Path
+    taken_at: datetime
+    size: int
+    pre_restore: bool = False
+
+
+def _snapshot(dest: Path) -> None:
+    src = sqlite3.connect(DATABASE_PATH)
+    try:
+        dst = sqlite3.connect(dest)
+        try:
+            # One step: a single read transaction, so the copy is consistent
+            # and is not restarted by writes landing while it runs.
+            src.backup(dst)
+            # Self-contained file: no -wal/-shm next to the archive or its restores.
+            dst.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            dst.close()
+    finally:
+        src.close()
+
+
+def _verify(path: Path) -> None:
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute("PRAGMA integrity_check").fetchall()
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        raise BackupError(str(e)) from e
+    if [tuple(r) for r in rows] != [("ok",)]:
+        raise BackupError("; ".join(str(r[0]) for r in rows[:5]))
+
+
+def _compress(src: Path, dest: Path) -> None:
+    with open(src, "rb") as fin, gzip.open(dest, "wb", compresslevel=6) as fout:
+        shutil.copyfileobj(fin, fout, _CHUNK)
+
+
+def _create(directory: Path, name: str) -> Backup:
+    directory.mkdir(parents=True, exist_ok=True)
+    raw = directory / f"{name}.sqlite3"
+    archive = directory / f"{name}.sqlite3.gz"
+    partial = directory / f"{name}.sqlite3.gz.tmp"
+    _snapshot(raw)
+    try:
+        _verify(raw)
+        _compress(raw, partial)
+        # Only complete archives ever carry the final name.
+        os.replace(partial, archive)
+        raw_size = raw.stat().st_size
+    finally:
+        raw.unlink(missing_ok=True)
+        partial.unlink(missing_ok=True)
+    return Backup(archive, raw_size, archive.stat().st_size)
+
+
+def _split(path: Path, part_bytes: int) -> list[Path]:
+    """Cut ``path`` into files of at most ``part_bytes``; returns [path] if it fits."""
+    size = path.stat().st_size
+    if size <= part_bytes:
+        return [path]
+    count = -(-size // part_bytes)
+    parts = []
+    with open(path, "rb") as fin:
+        for i in range(1, count + 1):
+            part = path.with_name(f"{path.name}.part{i:02d}of{count:02d}")
+            with open(part, "wb") as fout:
+                remaining = part_bytes
+                while remaining:
+                    chunk = fin.read(min(_CHUNK, remaining))
+                    if not chunk:
+                        break
+                    fout.write(chunk)
+                    remaining -= len(chunk)
+            parts.append(part)
+    return parts
+
+
+def backup_name(when: Optional[datetime] = None, prefix: str = "bot_backup") -> str:
+    when = when or datetime.now(timezone.utc)
+    return f"{prefix}-" + when.strftime("%Y%m%d-%H%M%S")
+
+
+def list_snapshots(directory: Path = Path(BACKUP_DIR)) -> list[Snapshot]:
+    """Stored snapshots (scheduled and pre-restore), newest first."""
+    if not directory.is_dir():
+        return []
+    out = []
+    for p in directory.iterdir():
+        m = _NAME_RE.match(p.name)
+        if m:
+            taken = datetime.strptime(m.group(2), "%Y%m%d-%H%M%S").replace(tzinfo=timezone.utc)
+            out.append(Snapshot(p, taken, p.stat().st_size, m.group(1) == _PRE_RESTORE))
+    return sorted(out, key=lambda s: s.taken_at, reverse=True)
+
+
+def expired(snapshots: list[Snapshot], now: datetime) -> list[Snapshot]:
+    """Scheduled snapshots outside the retention policy.
+
+    Within BACKUP_KEEP_HOURLY_H the newest snapshot of each hour is kept, within
+    BACKUP_KEEP_DAILY_D the newest of each day; the most recent one always stays.
+    Pre-restore snapshots are never expired.
+    """
+    hourly_from = now - timedelta(hours=BACKUP_KEEP_HOURLY_H)
+    daily_from = now - timedelta(days=BACKUP_KEEP_DAILY_D)
+    seen: set[tuple] = set()
+    drop = []
+    scheduled = [s for s in snapshots if not s.pre_restore]
+    for i, snap in enumerate(sorted(scheduled, key=lambda s: s.taken_at, reverse=True)):
+        t = snap.taken_at
+        if t >= hourly_from:
+            bucket: Optional[tuple] = ("h", t.year, t.month, t.day, t.hour)
+        elif t >= daily_from:
+            bucket = ("d", t.year, t.month, t.day)
+        else:
+            bucket = None
+        if i == 0 or (bucket is not None and bucket not in seen):
+            seen.add(bucket)
+            continue
+        drop.append(snap)
+    return drop
+
+
+async def create_backup(directory: Path, name: Optional[str] = None) -> Backup:
+    """Snapshot and compress the database into ``directory`` (in a worker thread)."""
+    return await asyncio.to_thread(_create, directory, name or backup_name())
+
+
+async def send_file(bot: ExtBot, chat_id: int, path: Path, caption: str) -> list[Path]:
+    """Upload ``path`` as one or more documents, streaming each from disk.
+
+    Returns the files sent (the parts, when split; they are deleted afterwards).
+    """
+    parts = await asyncio.to_thread(_split, path, BACKUP_PART_BYTES)
+    try:
+        for i, part in enumerate(parts, start=1):
+            text = caption if len(parts) == 1 else f"{caption}\nجزء {i}/{len(parts)}"
+            with open(part, "rb") as f:
+                await bot.send_document(
+                    chat_id=chat_id,
+                    document=InputFile(f, filename=part.name, read_file_handle=False),
+                    caption=text,
+                    write_timeout=_UPLOAD_TIMEOUT_S,
+                    rate_limit_args=Priority.ADMIN,
+                )
+    finally:
+        for part in parts:
+            if part != path:
+                part.unlink(missing_ok=True)
+    return parts
+
+
+async def send_backup(bot: ExtBot, chat_id: int) -> Backup:
+    """Take a fresh backup, send it to ``chat_id`` and delete the local copy."""
+    with tempfile.TemporaryDirectory(prefix="bot_backup_") as tmp:
+        backup = await create_backup(Path(tmp))
+        parts = await send_file(bot, chat_id, backup.path, "📦 نسخة احتياطية من قاعدة البيانات")
+        logger.info(
+            "Backup sent: %d bytes (%d compressed) in %d part(s)",
+            backup.raw_size,
+            backup.size,
+            len(parts),
+        )
+        return backup
+
+
+def _prune(directory: Path) -> int:
+    drop = expired(list_snapshots(directory), datetime.now(timezone.utc))
+    for snap in drop:
+        snap.path.unlink(missing_ok=True)
+    return len(drop)
+
+
+async def backup_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Scheduled snapshot into BACKUP_DIR, then retention pruning."""
+    global _changes_at_last_backup, last_run
+    directory = Path(BACKUP_DIR)
+    changes = db.total_changes()
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+    if changes == _changes_at_last_backup and list_snapshots(directory):
+        last_run = f"{now}: لا تغييرات منذ آخر نسخة"
+        logger.debug("Scheduled backup skipped: no writes since the last one")
+        return
+    try:
+        backup = await create_backup(directory)
+    except Exception as e:
+        last_run = f"{now}: فشل ({e})"
+        logger.exception("Scheduled backup failed")
+        await context.bot.send_message(
+            chat_id=ADMIN_ID,
+            text=f"⚠️ فشل النسخ الاحتياطي التلقائي:\n{e}",
+            rate_limit_args=Priority.ADMIN,
+        )
+        return
+    # Counted before the snapshot: writes racing with it trigger the next run.
+    _changes_at_last_backup = changes
+    pruned = await asyncio.to_thread(_prune, directory)
+    last_run = f"{now}: تم ({backup.size / 1024 / 1024:.1f} MB)"
+    logger.info(
+        "Scheduled backup %s: %d bytes compressed, %d old snapshot(s) removed",
+        backup.path.name,
+        backup.size,
+        pruned,
+    )
+
+
+def _prepared_path() -> Path:
+    # Next to the database so the swap is a same-filesystem rename.
+    return Path(DATABASE_PATH + ".restore")
+
+
+def _check_schema(path: Path) -> dict[str, int]:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > db.SCHEMA_VERSION:
+            raise BackupError(f"schema v{version} is newer than this bot (v{db.SCHEMA_VERSION})")
+        counts = {}
+        for table, columns in _REQUIRED_SCHEMA.items():
+            have = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+            if not have:
+                raise BackupError(f"missing table {table}")
+            missing = columns - have
+            if missing:
+                raise BackupError(f"{table}: missing columns {', '.join(sorted(missing))}")
+            counts[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        return counts
+    finally:
+        conn.close()
+
+
+def _prepare(src: Path) -> dict[str, int]:
+    dest = _prepared_path()
+    with open(src, "rb") as f:
+        gzipped = f.read(2) == b"\x1f\x8b"
+    try:
+        if gzipped:
+            with gzip.open(src, "rb") as fin, open(dest, "wb") as fout:
+                shutil.copyfileobj(fin, fout, _CHUNK)
+        else:
+            shutil.copyfile(src, dest)
+        _verify(dest)
+        return _check_schema(dest)
+    except (OSError, EOFError, sqlite3.DatabaseError) as e:
+        dest.unlink(missing_ok=True)
+        raise BackupError(str(e)) from e
+    except BackupError:
+        dest.unlink(missing_ok=True)
+        raise
+
+
+def _interrupt_broadcasts(path: Path) -> int:
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            cur = conn.execute(
+                "UPDATE broadcasts SET status = 'interrupted', finished_at = ? "
+                "WHERE status = 'running'",
+                (datetime.now(timezone.utc).isoformat(),),
+            )
+        return cur.rowcount
+    finally:
+        conn.close()
+
+
+async def prepare_restore(src: Path) -> dict[str, int]:
+    """Decompress, validate and migrate an uploaded backup.
+
+    Returns row counts per table, plus ``interrupted_broadcasts``: broadcasts that
+    were running in the backup and will not be resumed. Raises BackupError if the
+    file is not a healthy database this bot can open.
+    """
+    counts = await asyncio.to_thread(_prepare, src)
+    dest = _prepared_path()
+    try:
+        await db.check_database(str(dest))
+        counts["interrupted_broadcasts"] = await asyncio.to_thread(_interrupt_broadcasts, dest)
+    except (sqlite3.Error, RuntimeError) as e:
+        dest.unlink(missing_ok=True)
+        raise BackupError(str(e)) from e
+    return counts
+
+
+def discard_prepared() -> None:
+    _prepared_path().unlink(missing_ok=True)
+
+
+async def restore_prepared() -> tuple[Optional[Backup], float]:
+    """Swap the prepared file in; returns the snapshot of the old data and swap seconds.
+
+    The snapshot is None when the current database fails verification itself.
+    """
+    prepared = _prepared_path()
+    if not prepared.exists():
+        raise BackupError("no prepared backup")
+    try:
+        previous: Optional[Backup] = await create_backup(
+            Path(BACKUP_DIR), backup_name(prefix=_PRE_RESTORE)
+        )
+    except BackupError as e:
+        logger.warning("Current database failed verification, restoring without a snapshot: %s", e)
+        previous = None
+    # Broadcast progress lives in the database being replaced.
+    await broadcast_svc.stop_all()
+    start = time.perf_counter()
+    await db.replace_database(str(prepared))
+    swap_s = time.perf_counter() - start
+    upload_svc.reset()
+    await catalog_svc.reload()
+    logger.info(
+        "Database restored in %.0f ms (previous data saved as %s)",
+        swap_s * 1000,
+        previous.path.name if previous else "-",
+    )
+    return previous, swap_s
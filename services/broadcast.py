@@ -1,59 +1,225 @@
-"""Broadcast messages to all users."""
+"""Broadcast messages to all users.
+
+A broadcast runs as a background task: user ids are streamed from the database
+in ``user_id`` order, ``BROADCAST_CHUNK_SIZE`` at a time, with up to
+``BROADCAST_CONCURRENCY`` sends in flight. Sends go through the outbox at
+``Priority.BROADCAST``, which holds the global rate and handles flood control.
+After each chunk the position is checkpointed in the ``broadcasts`` table, so
+after a restart ``resume_pending`` continues from there (at most one chunk is
+sent twice).
+"""
 
 from __future__ import annotations
 
+import asyncio
 import logging
+from datetime import datetime, timezone
+from typing import AsyncIterator
 
-from telegram.ext import ContextTypes
+from telegram.error import BadRequest, Forbidden
+from telegram.ext import ContextTypes, ExtBot
 
 import db
+from config import (
+    ADMIN_ID,
+    BROADCAST_CHUNK_SIZE,
+    BROADCAST_CONCURRENCY,
+    USER_MAX_SEND_FAILURES,
+)
+from services import activity as activity_svc
+from services.outbox import Priority
 
 logger = logging.getLogger(__name__)
 
+_tasks: dict[int, asyncio.Task] = {}
+
+# Outcomes of one send attempt.
+_SENT = "sent"
+_BLOCKED = "blocked"  # Forbidden: the user blocked the bot or was deactivated
+_FAILED = "failed"  # recipient-specific BadRequest; counts toward USER_MAX_SEND_FAILURES
+_ERROR = "error"  # transient or unexplained; not held against the user
+_ABORT = "abort"  # the source message itself is unusable; stops the broadcast
+
+# Lowercased substrings of BadRequest descriptions: errors about the recipient
+# and errors about the message being sent. Any other BadRequest is an _ERROR.
+_RECIPIENT_ERRORS = (
+    "chat not found",
+    "user not found",
+    "peer_id_invalid",
+    "user is deactivated",
+    "bot can't initiate conversation",
+    "chat_write_forbidden",
+    "not enough rights",
+    "have no rights to send",
+)
+_SOURCE_ERRORS = (
+    "message to copy not found",
+    "message_id_invalid",
+    "message can't be copied",
+    "message is too long",
+    "message text is empty",
+)
+
+
+async def iter_all_user_ids(after_user_id: int = 0) -> AsyncIterator[list[int]]:
+    """Stream reachable user ids (ascending) after the checkpoint, one chunk at a time."""
+    await activity_svc.flush()
+    async for chunk in db.iter_user_id_chunks(after_user_id, BROADCAST_CHUNK_SIZE):
+        yield chunk
+
+
+async def _send_one(bot: ExtBot, row: dict, user_id: int) -> str:
+    try:
+        if row["text"] is not None:
+            await bot.send_message(
+                chat_id=user_id, text=row["text"], rate_limit_args=Priority.BROADCAST
+            )
+        else:
+            await bot.copy_message(
+                chat_id=user_id,
+                from_chat_id=row["from_chat_id"],
+                message_id=row["message_id"],
+                rate_limit_args=Priority.BROADCAST,
+            )
+        return _SENT
+    except Forbidden:
+        return _BLOCKED
+    except BadRequest as e:
+        reason = e.message.lower()
+        if any(m in reason for m in _SOURCE_ERRORS):
+            logger.warning("Broadcast source message unusable: %s", e)
+            return _ABORT
+        if any(m in reason for m in _RECIPIENT_ERRORS):
+            logger.debug("Broadcast rejected for %s: %s", user_id, e)
+            return _FAILED
+        logger.warning("Broadcast send failed for %s: %s", user_id, e)
+        return _ERROR
+    except Exception as e:
+        logger.warning("Broadcast send failed for %s: %s", user_id, e)
+        return _ERROR
+
+
+async def _run(bot: ExtBot, broadcast_id: int) -> None:
+    row = await db.get_broadcast(broadcast_id)
+    if row is None or row["status"] != "running":
+        return
+    ok, fail = row["ok"], row["fail"]
+    sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def send(uid: int) -> str:
+        async with sem:
+            return await _send_one(bot, row, uid)
 
-async def iter_all_user_ids() -> list[int]:
-    """Fetch all user ids from DB."""
-    conn = await db.get_db()
-    cur = await conn.execute("SELECT user_id FROM users")
-    rows = await cur.fetchall()
-    return [int(r[0]) for r in rows]
-
-
-async def send_broadcast_copy(
-    context: ContextTypes.DEFAULT_TYPE,
-    from_chat_id: int,
-    message_id: int,
-) -> tuple[int, int]:
-    """Copy message to every user. Returns (success_count, fail_count)."""
-    user_ids = await iter_all_user_ids()
-    ok = 0
-    fail = 0
-    for uid in user_ids:
-        try:
-            await context.bot.copy_message(
-                chat_id=uid,
-                from_chat_id=from_chat_id,
-                message_id=message_id,
+    async for chunk in iter_all_user_ids(row["last_user_id"]):
+        results = await asyncio.gather(*(send(uid) for uid in chunk))
+        by_outcome: dict[str, list[int]] = {
+            _SENT: [], _BLOCKED: [], _FAILED: [], _ERROR: [], _ABORT: []
+        }
+        for uid, outcome in zip(chunk, results):
+            by_outcome[outcome].append(uid)
+        ok += len(by_outcome[_SENT])
+        fail += len(chunk) - len(by_outcome[_SENT])
+        await db.record_delivery_results(
+            by_outcome[_SENT],
+            by_outcome[_BLOCKED],
+            by_outcome[_FAILED],
+            USER_MAX_SEND_FAILURES,
+        )
+        await db.checkpoint_broadcast(broadcast_id, chunk[-1], ok, fail)
+        if by_outcome[_ABORT]:
+            # Every remaining user would hit the same error.
+            await db.finish_broadcast(broadcast_id, "aborted")
+            logger.warning("Broadcast %d aborted: source message unusable", broadcast_id)
+            await _report(
+                bot,
+                row["admin_id"],
+                f"⛔ تم إيقاف الإرسال الجماعي #{broadcast_id}: الرسالة الأصلية لم تعد "
+                f"متاحة أو لا يمكن إرسالها.\nنجاح: {ok}\nفشل: {fail}",
             )
-            ok += 1
-        except Exception as e:
-            logger.warning("Broadcast copy failed for %s: %s", uid, e)
-            fail += 1
-    return ok, fail
-
-
-async def send_broadcast_text(
-    context: ContextTypes.DEFAULT_TYPE,
-    text: str,
-) -> tuple[int, int]:
-    user_ids = await iter_all_user_ids()
-    ok = 0
-    fail = 0
-    for uid in user_ids:
-        try:
-            await context.bot.send_message(chat_id=uid, text=text)
-            ok += 1
-        except Exception as e:
-            logger.warning("Broadcast text failed for %s: %s", uid, e)
-            fail += 1
-    return ok, fail
+            await db.add_log(
+                row["admin_id"], "broadcast", f"id={broadcast_id} aborted ok={ok} fail={fail}"
+            )
+            return
+
+    await db.finish_broadcast(broadcast_id)
+    logger.info("Broadcast %d finished: ok=%d fail=%d", broadcast_id, ok, fail)
+    await _report(
+        bot,
+        row["admin_id"],
+        f"✅ اكتمل الإرسال الجماعي #{broadcast_id}.\nنجاح: {ok}\nفشل: {fail}",
+    )
+    await db.add_log(row["admin_id"], "broadcast", f"id={broadcast_id} ok={ok} fail={fail}")
+
+
+async def _report(bot: ExtBot, admin_id: int, text: str) -> None:
+    try:
+        await bot.send_message(chat_id=admin_id, text=text, rate_limit_args=Priority.ADMIN)
+    except Exception as e:
+        logger.warning("Could not report broadcast to %s: %s", admin_id, e)
+
+
+def _spawn(bot: ExtBot, broadcast_id: int) -> None:
+    task = asyncio.create_task(_run(bot, broadcast_id), name=f"broadcast-{broadcast_id}")
+    _tasks[broadcast_id] = task
+
+    def _done(t: asyncio.Task) -> None:
+        _tasks.pop(broadcast_id, None)
+        if not t.cancelled() and t.exception() is not None:
+            logger.error("Broadcast %d crashed", broadcast_id, exc_info=t.exception())
+
+    task.add_done_callback(_done)
+
+
+async def start_broadcast_copy(
+    bot: ExtBot, admin_id: int, from_chat_id: int, message_id: int
+) -> int:
+    """Queue a copy of the message to every user. Returns the broadcast id."""
+    bid = await db.create_broadcast(admin_id, from_chat_id=from_chat_id, message_id=message_id)
+    _spawn(bot, bid)
+    return bid
+
+
+async def start_broadcast_text(bot: ExtBot, admin_id: int, text: str) -> int:
+    bid = await db.create_broadcast(admin_id, text=text)
+    _spawn(bot, bid)
+    return bid
+
+
+async def resume_pending(bot: ExtBot) -> int:
+    """Restart broadcasts left running by a previous process. Returns how many."""
+    rows = await db.list_running_broadcasts()
+    for row in rows:
+        if row["id"] not in _tasks:
+            logger.info(
+                "Resuming broadcast %d after user %d", row["id"], row["last_user_id"]
+            )
+            _spawn(bot, row["id"])
+    return len(rows)
+
+
+async def stop_all() -> None:
+    """Cancel running broadcasts; their checkpoints let the next start resume them."""
+    tasks = list(_tasks.values())
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def reachability_report_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Periodic summary to the main admin of users broadcasts now skip."""
+    since = await db.get_setting("reachability_report_at")
+    stats = await db.reachability_stats(since or None)
+    await db.set_setting("reachability_report_at", datetime.now(timezone.utc).isoformat())
+    if not stats["new_unreachable"] and not stats["failing"]:
+        return
+    total = await db.count_users()
+    await context.bot.send_message(
+        chat_id=ADMIN_ID,
+        text=(
+            "🧹 تقرير المستخدمين غير المتاحين\n\n"
+            f"🚫 جدد منذ آخر تقرير: {stats['new_unreachable']}\n"
+            f"🚫 الإجمالي (يتم تخطيهم في الإرسال الجماعي): {stats['unreachable']} من {total}\n"
+            f"⚠️ فشل الإرسال لهم مؤخرًا: {stats['failing']}"
+        ),
+        rate_limit_args=Priority.ADMIN,
+    )
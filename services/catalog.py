@@ -0,0 +1,195 @@
+"""Immutable in-memory snapshot of subjects, lectures and links for user browsing.
+
+The snapshot is built from the database and swapped whole (copy-on-write):
+after any catalog mutation in db.py, the next read builds a fresh snapshot
+while readers holding the previous one keep a consistent view.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Mapping, Optional, Sequence
+
+import db
+
+logger = logging.getLogger(__name__)
+
+
+def _page(
+    items: Sequence[dict[str, Any]],
+    lo: int,
+    hi: int,
+    page: int,
+    page_size: int,
+    *,
+    newest_first: bool = False,
+) -> db.Page:
+    """Page over ``items[lo:hi]``; an empty slice falls back to the first page."""
+    total = len(items)
+    if lo >= hi or lo >= total:
+        page = 0
+        lo, hi = (max(0, total - page_size), total) if newest_first else (0, page_size)
+    rows = list(items[lo:hi])
+    if newest_first:
+        rows.reverse()
+    total_pages = max(1, math.ceil(total / page_size))
+    return db.Page(rows, total, max(0, min(page, total_pages - 1)), total_pages)
+
+
+def _seek_bounds(
+    keys: Sequence[tuple[Any, int]],
+    page_size: int,
+    after: Optional[tuple[Any, int]],
+    before: Optional[tuple[Any, int]],
+    offset: int,
+) -> tuple[int, int]:
+    """Slice bounds of a page in ascending ``keys``.
+
+    ``after`` / ``before`` is the key of the last / first row of the neighbouring
+    page (keyset seek); without a cursor ``offset`` is used.
+    """
+    if before is not None:
+        hi = bisect_left(keys, before)
+        return max(0, hi - page_size), hi
+    lo = bisect_right(keys, after) if after is not None else offset
+    return lo, lo + page_size
+
+
+@dataclass(frozen=True)
+class Catalog:
+    version: int
+    subjects: tuple[dict[str, Any], ...]
+    subject_keys: tuple[tuple[int, int], ...]
+    subjects_by_id: Mapping[int, dict[str, Any]]
+    lectures_by_subject: Mapping[int, tuple[dict[str, Any], ...]]
+    lecture_keys_by_subject: Mapping[int, tuple[tuple[int, int], ...]]
+    lectures_by_id: Mapping[int, dict[str, Any]]
+    # Oldest first, keyed by (created_at, id); "latest" pages read it backwards.
+    by_created: tuple[dict[str, Any], ...]
+    created_keys: tuple[tuple[str, int], ...]
+    links: tuple[dict[str, Any], ...]
+
+    def subject(self, subject_id: int) -> Optional[dict[str, Any]]:
+        return self.subjects_by_id.get(subject_id)
+
+    def lecture(self, lecture_id: int) -> Optional[dict[str, Any]]:
+        return self.lectures_by_id.get(lecture_id)
+
+    def lectures_in_subject(self, subject_id: int) -> tuple[dict[str, Any], ...]:
+        return self.lectures_by_subject.get(subject_id, ())
+
+    def subjects_page(
+        self,
+        page: int,
+        page_size: int,
+        *,
+        after: Optional[tuple[int, int]] = None,
+        before: Optional[tuple[int, int]] = None,
+        offset: int = 0,
+    ) -> db.Page:
+        lo, hi = _seek_bounds(self.subject_keys, page_size, after, before, offset)
+        return _page(self.subjects, lo, hi, page, page_size)
+
+    def lectures_page(
+        self,
+        subject_id: int,
+        page: int,
+        page_size: int,
+        *,
+        after: Optional[tuple[int, int]] = None,
+        before: Optional[tuple[int, int]] = None,
+        offset: int = 0,
+    ) -> db.Page:
+        items = self.lectures_in_subject(subject_id)
+        keys = self.lecture_keys_by_subject.get(subject_id, ())
+        lo, hi = _seek_bounds(keys, page_size, after, before, offset)
+        return _page(items, lo, hi, page, page_size)
+
+    def latest_page(
+        self,
+        page: int,
+        page_size: int,
+        *,
+        after: Optional[tuple[str, int]] = None,
+        before: Optional[tuple[str, int]] = None,
+        offset: int = 0,
+    ) -> db.Page:
+        """Newest first; ``after`` continues with older lectures, ``before`` with newer."""
+        # by_created is ascending, so "older" (after) and "newer" (before) swap sides.
+        keys = self.created_keys
+        if after is not None:
+            hi = bisect_left(keys, after)
+            lo = max(0, hi - page_size)
+        elif before is not None:
+            lo = bisect_right(keys, before)
+            hi = lo + page_size
+        else:
+            hi = len(keys) - offset
+            lo = max(0, hi - page_size)
+        return _page(self.by_created, lo, hi, page, page_size, newest_first=True)
+
+
+_snapshot: Optional[Catalog] = None
+_build_lock = asyncio.Lock()
+
+
+async def _build() -> Catalog:
+    # Read the version first: a mutation during the load makes it stale again.
+    version = db.catalog_version()
+    subjects = await db.list_all_subjects()
+    lectures = await db.list_all_lectures()
+    links = await db.list_links()
+
+    subjects_by_id = {s["id"]: s for s in subjects}
+    grouped: dict[int, list[dict[str, Any]]] = {}
+    for lec in lectures:
+        sub = subjects_by_id.get(lec["subject_id"])
+        lec["subject_name"] = sub["name"] if sub else ""
+        grouped.setdefault(lec["subject_id"], []).append(lec)
+    by_created = sorted(lectures, key=lambda r: (r["created_at"], r["id"]))
+
+    return Catalog(
+        version=version,
+        subjects=tuple(subjects),
+        subject_keys=tuple((s["sort_order"], s["id"]) for s in subjects),
+        subjects_by_id=MappingProxyType(subjects_by_id),
+        lectures_by_subject=MappingProxyType({k: tuple(v) for k, v in grouped.items()}),
+        lecture_keys_by_subject=MappingProxyType(
+            {k: tuple((r["sort_order"], r["id"]) for r in v) for k, v in grouped.items()}
+        ),
+        lectures_by_id=MappingProxyType({r["id"]: r for r in lectures}),
+        by_created=tuple(by_created),
+        created_keys=tuple((r["created_at"], r["id"]) for r in by_created),
+        links=tuple(links),
+    )
+
+
+async def current() -> Catalog:
+    """Return the current snapshot, rebuilding it if the catalog changed since."""
+    global _snapshot
+    snap = _snapshot
+    if snap is not None and snap.version == db.catalog_version():
+        return snap
+    async with _build_lock:
+        if _snapshot is None or _snapshot.version != db.catalog_version():
+            _snapshot = await _build()
+            logger.debug(
+                "Catalog snapshot v%d: %d subjects, %d lectures",
+                _snapshot.version,
+                len(_snapshot.subjects),
+                len(_snapshot.lectures_by_id),
+            )
+        return _snapshot
+
+
+async def reload() -> Catalog:
+    """Force a rebuild (startup, or after the database file was replaced)."""
+    global _snapshot
+    async with _build_lock:
+        _snapshot = await _build()
+        return _snapshot
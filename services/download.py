@@ -0,0 +1,103 @@
+""""Download all" for a subject: background media-group sends, one job per chat.
+
+Sends go through the outbox at ``Priority.BULK``, which paces them per chat and
+retries flood-control errors.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Sequence
+
+from telegram import InputMediaDocument, Message
+from telegram.error import BadRequest
+from telegram.ext import ExtBot
+
+from config import DOWNLOAD_BATCH_SIZE
+from services.outbox import Priority
+
+logger = logging.getLogger(__name__)
+
+# chat_id -> running job; a second request from the same chat is refused.
+_active: dict[int, asyncio.Task] = {}
+
+
+async def _send_document(bot: ExtBot, chat_id: int, lec: dict[str, Any]) -> None:
+    await bot.send_document(
+        chat_id=chat_id,
+        document=lec["file_id"],
+        caption=f"📄 {lec['title']}",
+        rate_limit_args=Priority.BULK,
+    )
+
+
+async def _send_batch(bot: ExtBot, chat_id: int, batch: Sequence[dict[str, Any]]) -> None:
+    if len(batch) == 1:
+        # sendMediaGroup needs at least two items.
+        await _send_document(bot, chat_id, batch[0])
+        return
+    media = [InputMediaDocument(lec["file_id"], caption=f"📄 {lec['title']}") for lec in batch]
+    try:
+        await bot.send_media_group(chat_id=chat_id, media=media, rate_limit_args=Priority.BULK)
+    except BadRequest as e:
+        # One bad file_id fails the whole album; fall back to single sends.
+        logger.warning("Media group failed in chat %s (%s); sending one by one", chat_id, e)
+        for lec in batch:
+            try:
+                await _send_document(bot, chat_id, lec)
+            except BadRequest as e2:
+                logger.warning("send_document failed for lecture %s: %s", lec["id"], e2)
+
+
+async def _edit_progress(bot: ExtBot, progress: Message, text: str) -> None:
+    try:
+        await bot.edit_message_text(
+            text,
+            chat_id=progress.chat_id,
+            message_id=progress.message_id,
+            rate_limit_args=Priority.BULK,
+        )
+    except Exception as e:
+        logger.debug("Progress edit failed: %s", e)
+
+
+async def _run(bot: ExtBot, chat_id: int, lectures: Sequence[dict[str, Any]]) -> None:
+    total = len(lectures)
+    progress = await bot.send_message(
+        chat_id=chat_id, text=f"📥 جاري إرسال {total} ملفًا...", rate_limit_args=Priority.BULK
+    )
+    sent = 0
+    for i in range(0, total, DOWNLOAD_BATCH_SIZE):
+        batch = lectures[i : i + DOWNLOAD_BATCH_SIZE]
+        await _send_batch(bot, chat_id, batch)
+        sent += len(batch)
+        if sent < total:
+            await _edit_progress(bot, progress, f"📥 جاري الإرسال... {sent}/{total}")
+    await _edit_progress(bot, progress, f"✅ تم إرسال {total} ملفًا.")
+
+
+def start(bot: ExtBot, chat_id: int, lectures: Sequence[dict[str, Any]]) -> bool:
+    """Start sending ``lectures`` to ``chat_id`` in the background.
+
+    Returns False if a download-all is already running for this chat.
+    """
+    if chat_id in _active:
+        return False
+    task = asyncio.create_task(_run(bot, chat_id, lectures), name=f"download-all-{chat_id}")
+    _active[chat_id] = task
+
+    def _done(t: asyncio.Task) -> None:
+        _active.pop(chat_id, None)
+        if not t.cancelled() and t.exception() is not None:
+            logger.error("Download-all failed for chat %s", chat_id, exc_info=t.exception())
+
+    task.add_done_callback(_done)
+    return True
+
+
+async def stop_all() -> None:
+    tasks = list(_active.values())
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
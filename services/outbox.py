@@ -0,0 +1,173 @@
+"""Prioritized outbound scheduler for every Bot API call.
+
+Installed as the application's rate limiter, so each ``context.bot`` call passes
+through it. Calls that target a chat wait for a token from one global bucket;
+when several are waiting, the lowest ``Priority`` goes first, so a running
+broadcast never delays menus. Background classes (bulk, broadcast) are also paced
+per chat. ``RetryAfter`` pauses the whole bucket and the call is retried here,
+so callers only see it after ``OUTBOX_MAX_RETRIES``.
+
+Callers pick a class with ``rate_limit_args``::
+
+    await context.bot.send_message(chat_id, text, rate_limit_args=Priority.BROADCAST)
+
+Calls without it are interactive.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from enum import IntEnum
+from typing import Any, Callable, Coroutine, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import OUTBOX_MAX_RETRIES, OUTBOX_PER_CHAT_INTERVAL_S, OUTBOX_RATE_PER_S
+from utils.ratelimit import TokenBucket, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+_Result = Union[bool, dict[str, Any], list[dict[str, Any]]]
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    ADMIN = 1
+    BULK = 2
+    BROADCAST = 3
+
+
+# Classes that send many messages to one chat in the background.
+_PACED = (Priority.BULK, Priority.BROADCAST)
+
+
+class OutboxRateLimiter(BaseRateLimiter[Priority]):
+    def __init__(
+        self,
+        rate: float = OUTBOX_RATE_PER_S,
+        per_chat_interval: float = OUTBOX_PER_CHAT_INTERVAL_S,
+        max_retries: int = OUTBOX_MAX_RETRIES,
+    ) -> None:
+        self._bucket = TokenBucket(rate)
+        self._per_chat_interval = per_chat_interval
+        self._max_retries = max_retries
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        # chat_id -> monotonic time of the next paced send allowed to that chat
+        self._chat_next: dict[Union[int, str], float] = {}
+        self.sent = {p: 0 for p in Priority}
+        self.retries = 0
+
+    async def initialize(self) -> None:
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch(), name="outbox-dispatcher")
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        for _, _, fut in self._waiters:
+            fut.cancel()
+        self._waiters.clear()
+
+    def pending(self) -> dict[Priority, int]:
+        counts = {p: 0 for p in Priority}
+        for prio, _, fut in self._waiters:
+            if not fut.done():
+                counts[Priority(prio)] += 1
+        return counts
+
+    async def _dispatch(self) -> None:
+        """Hand out one global token at a time to the most urgent waiter."""
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self._bucket.acquire()
+            while self._waiters:
+                _, _, fut = heapq.heappop(self._waiters)
+                if not fut.done():
+                    fut.set_result(None)
+                    break
+
+    async def _wait_turn(self, priority: Priority) -> None:
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (int(priority), next(self._seq), fut))
+        self._wakeup.set()
+        await fut
+
+    async def _wait_chat(self, chat_id: Union[int, str]) -> None:
+        now = time.monotonic()
+        slot = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = slot + self._per_chat_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, _Result]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: Optional[Priority],
+    ) -> _Result:
+        priority = Priority.INTERACTIVE if rate_limit_args is None else Priority(rate_limit_args)
+        chat_id = data.get("chat_id")
+        for attempt in range(self._max_retries + 1):
+            if chat_id is not None:
+                if priority in _PACED:
+                    await self._wait_chat(chat_id)
+                await self._wait_turn(priority)
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self._max_retries:
+                    raise
+                delay = retry_after_seconds(e.retry_after)
+                logger.info(
+                    "%s flood control on %s: pausing %.1fs", priority.name, endpoint, delay
+                )
+                self.retries += 1
+                self._bucket.pause(delay)
+                if chat_id is not None:
+                    self._chat_next[chat_id] = time.monotonic() + delay
+                continue
+            self.sent[priority] += 1
+            if len(self._chat_next) > 10_000:
+                self._prune_chats()
+            return result
+        raise AssertionError("unreachable")
+
+    def _prune_chats(self) -> None:
+        now = time.monotonic()
+        self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+
+
+_limiter: Optional[OutboxRateLimiter] = None
+
+
+def get_limiter() -> OutboxRateLimiter:
+    """The process-wide limiter (created on first use, passed to the Application)."""
+    global _limiter
+    if _limiter is None:
+        _limiter = OutboxRateLimiter()
+    return _limiter
+
+
+def stats() -> dict[str, Any]:
+    lim = get_limiter()
+    return {
+        "sent": {p.name: n for p, n in lim.sent.items()},
+        "pending": {p.name: n for p, n in lim.pending().items()},
+        "retries": lim.retries,
+    }
@@ -1,60 +1,288 @@
-"""Batch upload session helpers (in-memory via context.user_data)."""
+"""Batch upload sessions, staged in the database as files arrive.
+
+Files are buffered in memory and written to ``upload_session_files`` every
+``UPLOAD_STAGE_FLUSH_EVERY`` files (and before finishing), so a restart loses at
+most one small buffer. The admin's open session survives restarts and can be
+resumed; finishing promotes the staged rows into ``lectures`` in one statement.
+``context.user_data[BATCH_KEY]`` only points at the session and its progress message.
+
+Documents sent as an album (same ``media_group_id``) arrive as separate updates;
+each takes its ``seq`` on arrival, and they are collected until
+``ALBUM_DEBOUNCE_S`` passes without another one and then staged together.
+``shutdown`` stages albums still waiting. Progress edits are throttled by time,
+not by file count.
+"""
 
 from __future__ import annotations
 
-from typing import Any, Optional
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+import db
+from config import ALBUM_DEBOUNCE_S, BATCH_UPLOAD_PROGRESS_INTERVAL_S, UPLOAD_STAGE_FLUSH_EVERY
+from utils.helpers import title_from_document_filename
+
+logger = logging.getLogger(__name__)
+
+ProgressEdit = Callable[[int], Awaitable[None]]
 
 BATCH_KEY = "batch_upload"
 
+# session_id -> files received but not yet staged
+_buffers: dict[int, list[dict[str, Any]]] = {}
+# (session_id, media_group_id) -> {"files": [...], "timer": Task, "on_done": ProgressEdit,
+# "batch": user_data[BATCH_KEY]}; the files already carry their seq
+_albums: dict[tuple[int, str], dict[str, Any]] = {}
+# session_id -> monotonic time of the last progress edit / scheduled trailing edit
+_progress_at: dict[int, float] = {}
+_progress_pending: dict[int, asyncio.Task] = {}
 
-def start_batch(
-    context_user_data: dict[str, Any],
-    subject_id: int,
-    progress_chat_id: int,
-    progress_message_id: int,
-) -> None:
+
+async def start_batch(context_user_data: dict[str, Any], admin_id: int, subject_id: int) -> int:
+    """Open a new session, discarding any earlier open session of this admin."""
+    prev = await db.get_open_upload_session(admin_id)
+    if prev:
+        await cancel_session(prev["id"])
+    session_id = await db.create_upload_session(admin_id, subject_id)
     context_user_data[BATCH_KEY] = {
+        "session_id": session_id,
         "subject_id": subject_id,
-        "files": [],
-        "cancelled": False,
-        "progress_chat_id": progress_chat_id,
-        "progress_message_id": progress_message_id,
+        "received": 0,
     }
+    return session_id
+
+
+def resume_batch(context_user_data: dict[str, Any], session: dict[str, Any]) -> None:
+    """Re-attach an open session from get_open_upload_session (e.g. after a restart)."""
+    session_id = session["id"]
+    held = [f["seq"] for f in _buffers.get(session_id, ())] + [
+        f["seq"] for key, album in _albums.items() if key[0] == session_id for f in album["files"]
+    ]
+    context_user_data[BATCH_KEY] = {
+        "session_id": session_id,
+        "subject_id": session["subject_id"],
+        "received": max([session["next_seq"] - 1, *held]) + 1,
+    }
+
+
+async def set_progress_message(
+    context_user_data: dict[str, Any], progress_chat_id: int, progress_message_id: int
+) -> None:
+    b = context_user_data.get(BATCH_KEY)
+    if not b:
+        return
+    b["progress_chat_id"] = progress_chat_id
+    b["progress_message_id"] = progress_message_id
+    await db.set_upload_session_progress(b["session_id"], progress_chat_id, progress_message_id)
 
 
 def get_batch(context_user_data: dict[str, Any]) -> Optional[dict[str, Any]]:
     return context_user_data.get(BATCH_KEY)
 
 
-def add_file_to_batch(
+def _take_seq(b: dict[str, Any]) -> int:
+    seq = b["received"]
+    b["received"] += 1
+    return seq
+
+
+def _buffer_file(session_id: int, file: dict[str, Any]) -> list[dict[str, Any]]:
+    buf = _buffers.setdefault(session_id, [])
+    buf.append(
+        {
+            "seq": file["seq"],
+            "title": title_from_document_filename(file["file_name"]),
+            "file_id": file["file_id"],
+            "file_unique_id": file["file_unique_id"],
+            "file_name": file["file_name"],
+        }
+    )
+    return buf
+
+
+async def add_file_to_batch(
     context_user_data: dict[str, Any],
     file_id: str,
     file_unique_id: Optional[str],
     file_name: Optional[str],
 ) -> int:
+    """Buffer one file; returns the number of files received in this session."""
     b = context_user_data.get(BATCH_KEY)
     if not b:
         return 0
-    b["files"].append(
+    buf = _buffer_file(
+        b["session_id"],
         {
+            "seq": _take_seq(b),
             "file_id": file_id,
             "file_unique_id": file_unique_id,
             "file_name": file_name,
-        }
+        },
     )
-    return len(b["files"])
+    if len(buf) >= UPLOAD_STAGE_FLUSH_EVERY:
+        await flush(b["session_id"])
+    return b["received"]
+
 
+async def add_album_file(
+    context_user_data: dict[str, Any],
+    media_group_id: str,
+    file_id: str,
+    file_unique_id: Optional[str],
+    file_name: Optional[str],
+    on_done: ProgressEdit,
+) -> None:
+    """Collect one album member; the album is staged once it stops growing.
 
-def cancel_batch(context_user_data: dict[str, Any]) -> None:
+    The file's position in the session is fixed now, in arrival order.
+    ``on_done`` is called with the session's received count after staging.
+    """
     b = context_user_data.get(BATCH_KEY)
-    if b:
-        b["cancelled"] = True
+    if not b:
+        return
+    key = (b["session_id"], media_group_id)
+    album = _albums.setdefault(key, {"files": [], "timer": None, "batch": b})
+    album["files"].append(
+        {
+            "seq": _take_seq(b),
+            "file_id": file_id,
+            "file_unique_id": file_unique_id,
+            "file_name": file_name,
+        }
+    )
+    album["on_done"] = on_done
+    if album["timer"] is not None:
+        album["timer"].cancel()
+    album["timer"] = asyncio.create_task(_album_timer(key))
+
+
+async def _album_timer(key: tuple[int, str]) -> None:
+    await asyncio.sleep(ALBUM_DEBOUNCE_S)
+    try:
+        await _stage_album(key)
+    except Exception:
+        logger.exception("Staging album %s failed", key[1])
+
+
+async def _stage_album(key: tuple[int, str]) -> None:
+    album = _albums.pop(key, None)
+    if not album:
+        return
+    for f in album["files"]:
+        _buffer_file(key[0], f)
+    await flush(key[0])
+    await album["on_done"](album["batch"]["received"])
+
+
+async def _flush_albums(session_id: int, stage: bool) -> None:
+    """Stage (or with ``stage`` False, drop) albums still inside their debounce window."""
+    for key in [k for k in _albums if k[0] == session_id]:
+        album = _albums[key]
+        # Still in _albums, so the timer is sleeping and has not started staging.
+        if album["timer"] is not None:
+            album["timer"].cancel()
+        if stage:
+            album["on_done"] = _noop_progress
+            await _stage_album(key)
+        else:
+            _albums.pop(key, None)
+
+
+async def _noop_progress(received: int) -> None:
+    pass
+
 
+async def report_progress(context_user_data: dict[str, Any], edit: ProgressEdit) -> None:
+    """Edit the progress message at most every BATCH_UPLOAD_PROGRESS_INTERVAL_S.
 
-def is_batch_cancelled(context_user_data: dict[str, Any]) -> bool:
+    A throttled call schedules one trailing edit, so the latest count still shows.
+    """
     b = context_user_data.get(BATCH_KEY)
-    return bool(b and b.get("cancelled"))
+    if not b or not b.get("progress_message_id"):
+        return
+    session_id = b["session_id"]
+    if session_id in _progress_pending:
+        return
+    wait = _progress_at.get(session_id, 0.0) + BATCH_UPLOAD_PROGRESS_INTERVAL_S - time.monotonic()
+    if wait <= 0:
+        _progress_at[session_id] = time.monotonic()
+        await edit(b["received"])
+        return
 
+    async def trailing() -> None:
+        await asyncio.sleep(wait)
+        _progress_pending.pop(session_id, None)
+        _progress_at[session_id] = time.monotonic()
+        try:
+            await edit(b["received"])
+        except Exception as e:
+            logger.debug("Trailing progress edit failed: %s", e)
 
-def clear_batch(context_user_data: dict[str, Any]) -> None:
-    context_user_data.pop(BATCH_KEY, None)
+    _progress_pending[session_id] = asyncio.create_task(trailing())
+
+
+def _forget(session_id: int) -> None:
+    task = _progress_pending.pop(session_id, None)
+    if task is not None:
+        task.cancel()
+    _progress_at.pop(session_id, None)
+
+
+async def flush(session_id: Optional[int] = None) -> None:
+    """Stage the buffered files of one session, or of all sessions."""
+    ids = [session_id] if session_id is not None else list(_buffers)
+    for sid in ids:
+        buf = _buffers.pop(sid, None)
+        if not buf:
+            continue
+        try:
+            await db.stage_upload_files(sid, buf)
+        except Exception:
+            # Keep the files (ahead of anything buffered meanwhile) for the next flush.
+            _buffers.setdefault(sid, [])[:0] = buf
+            raise
+
+
+async def finish_session(session_id: int) -> Optional[db.PromoteResult]:
+    """Promote staged files into lectures; None if the session is no longer open."""
+    await _flush_albums(session_id, stage=True)
+    _forget(session_id)
+    await flush(session_id)
+    return await db.promote_upload_session(session_id)
+
+
+async def cancel_session(session_id: int) -> None:
+    await _flush_albums(session_id, stage=False)
+    _forget(session_id)
+    _buffers.pop(session_id, None)
+    await db.cancel_upload_session(session_id)
+
+
+async def shutdown() -> None:
+    """Stage everything still in memory, including albums waiting out their debounce."""
+    for session_id in {key[0] for key in _albums}:
+        await _flush_albums(session_id, stage=True)
+    for session_id in list(_progress_pending):
+        _forget(session_id)
+    await flush()
+
+
+def reset() -> None:
+    """Forget all in-memory upload state (the database was replaced)."""
+    for album in _albums.values():
+        if album["timer"] is not None:
+            album["timer"].cancel()
+    _albums.clear()
+    for session_id in list(_progress_pending):
+        _forget(session_id)
+    _progress_at.clear()
+    _buffers.clear()
+
+
+def clear_batch(context_user_data: dict[str, Any], session_id: Optional[int] = None) -> None:
+    """Detach the session from user_data (only if it is ``session_id``, when given)."""
+    b = context_user_data.get(BATCH_KEY)
+    if b and (session_id is None or b["session_id"] == session_id):
+        context_user_data.pop(BATCH_KEY, None)
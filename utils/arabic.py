@@ -0,0 +1,36 @@
+"""Arabic-aware text normalization for search keys."""
+
+from __future__ import annotations
+
+import re
+from typing import Optional
+
+# Harakat, Quranic annotation marks and superscript alef.
+_TASHKEEL = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]")
+_TATWEEL = "\u0640"
+_FOLD = str.maketrans(
+    {
+        "أ": "ا",
+        "إ": "ا",
+        "آ": "ا",
+        "ٱ": "ا",
+        "ؤ": "و",
+        "ئ": "ي",
+        "ى": "ي",
+        "ة": "ه",
+    }
+)
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_arabic(text: Optional[str]) -> str:
+    """Fold spelling variants so e.g. «محاضرة»/«محاضره» and «أحياء»/«احياء» compare equal.
+
+    Strips tashkeel and tatweel, folds hamza/alef variants, taa marbuta and
+    alef maqsura, casefolds Latin text and collapses whitespace.
+    """
+    if not text:
+        return ""
+    t = _TASHKEEL.sub("", text).replace(_TATWEEL, "")
+    t = t.translate(_FOLD).casefold()
+    return _SPACES.sub(" ", t).strip()
@@ -3,7 +3,7 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Optional
+from typing import Any, Optional
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
@@ -41,6 +41,21 @@ def build_pagination_row(
     return buttons
 
 
+def seek_callback(prefix: str, page: int, direction: str, key: tuple[Any, Any]) -> str:
+    """Keyset pagination callback: ``{prefix}|{page}|{a|b}|{k1}|{k2}``.
+
+    ``a`` seeks after ``key`` (next page), ``b`` seeks before it (previous page).
+    """
+    return f"{prefix}|{page}|{direction}|{key[0]}|{key[1]}"
+
+
+def parse_seek_cursor(tail: list[str]) -> Optional[tuple[str, str, str]]:
+    """Parse the ``a|k1|k2`` tail written by seek_callback; None for plain page callbacks."""
+    if len(tail) == 3 and tail[0] in ("a", "b"):
+        return tail[0], tail[1], tail[2]
+    return None
+
+
 async def safe_edit_text(
     query,
     text: str,
@@ -0,0 +1,56 @@
+"""Async rate limiting for outgoing Bot API calls."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from datetime import timedelta
+from typing import Union
+
+
+def retry_after_seconds(value: Union[int, float, timedelta]) -> float:
+    """``RetryAfter.retry_after`` is an int or a timedelta depending on PTB settings."""
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class TokenBucket:
+    """Allow ``rate`` acquisitions per second with bursts up to ``capacity``.
+
+    ``pause()`` blocks every caller until a deadline, which is how a flood-control
+    ``RetryAfter`` from Telegram is applied to all senders sharing the bucket.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for ``seconds`` (extends, never shortens, a pause)."""
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            self._tokens = 0.0
+            self._updated = until
@@ -0,0 +1,69 @@
+"""Concurrent update processing that keeps each user's updates in order."""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+def sequence_key(update: object) -> Optional[int]:
+    """Updates with the same key run one at a time, in arrival order.
+
+    Keyed by user because ``context.user_data`` flows (admin ``_flow``,
+    ``batch_upload``, conversations) assume one update at a time per user.
+    """
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Run up to ``max_concurrent_updates`` updates at once, serialized per user."""
+
+    def __init__(self, max_concurrent_updates: int) -> None:
+        super().__init__(max_concurrent_updates)
+        # key -> [lock, number of updates holding or waiting for it]
+        self._locks: dict[int, list[Any]] = {}
+
+    # BaseUpdateProcessor.process_update takes a concurrency slot before calling
+    # do_process_update. Updates queued behind their user's lock would then hold
+    # slots while waiting, so one busy user could fill them all. Here the user's
+    # lock comes first: each user occupies at most one slot. (@final is only a
+    # type-checker marker.)
+    async def process_update(  # type: ignore[misc]
+        self, update: object, coroutine: Awaitable[Any]
+    ) -> None:
+        key = sequence_key(update)
+        if key is None:
+            async with self._semaphore:
+                await self.do_process_update(update, coroutine)
+            return
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock wakes waiters FIFO, so a user's updates keep their order.
+            async with entry[0]:
+                async with self._semaphore:
+                    await self.do_process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
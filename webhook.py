@@ -0,0 +1,210 @@
+"""Webhook mode: a small embedded HTTP server feeding the Application.
+
+Routes:
+    POST ``WEBHOOK_PATH``  Telegram update JSON (checked against ``WEBHOOK_SECRET``)
+    GET  /healthz          200 while the process is serving
+    GET  /readyz           200 once the database is open and the Application runs
+
+Updates are put on ``application.update_queue``, so handler groups, the update
+processor and the outbox behave exactly as in polling mode.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+import db
+from config import (
+    WEBHOOK_LISTEN,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+)
+
+logger = logging.getLogger(__name__)
+
+_MAX_BODY = 1024 * 1024
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+
+
+class _HttpError(Exception):
+    def __init__(self, status: int) -> None:
+        super().__init__(status)
+        self.status = status
+
+
+class WebhookServer:
+    def __init__(self, application: Application) -> None:
+        self.application = application
+        self.received = 0
+        self._server: Optional[asyncio.base_events.Server] = None
+
+    def ready(self) -> bool:
+        return self.application.running and db.is_open()
+
+    async def start(self, host: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT) -> None:
+        self._server = await asyncio.start_server(self._serve, host, port)
+        logger.info("Webhook server listening on %s:%d%s", host, port, WEBHOOK_PATH)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = await self._handle(request_line, reader, writer)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            logger.exception("Webhook connection failed")
+        finally:
+            writer.close()
+
+    async def _handle(
+        self,
+        request_line: bytes,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> bool:
+        try:
+            method, target, version = request_line.decode("latin-1").split()
+        except ValueError:
+            await self._respond(writer, 400, keep_alive=False)
+            return False
+        headers: dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = (
+            headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+        )
+        raw_length = headers.get("content-length") or "0"
+        if not (raw_length.isascii() and raw_length.isdigit()):
+            # Not a plain decimal count: the body cannot be framed.
+            await self._respond(writer, 400, keep_alive=False)
+            return False
+        length = int(raw_length)
+        if length > _MAX_BODY:
+            await self._respond(writer, 413, keep_alive=False)
+            return False
+        body = await reader.readexactly(length) if length else b""
+
+        path = target.split("?", 1)[0]
+        try:
+            status, text = await self._route(method, path, headers, body)
+        except _HttpError as e:
+            status, text = e.status, ""
+        await self._respond(writer, status, text, keep_alive=keep_alive)
+        return keep_alive
+
+    async def _route(
+        self, method: str, path: str, headers: dict[str, str], body: bytes
+    ) -> tuple[int, str]:
+        if path == "/healthz":
+            return 200, "ok"
+        if path == "/readyz":
+            return (200, "ready") if self.ready() else (503, "starting")
+        if path != WEBHOOK_PATH:
+            raise _HttpError(404)
+        if method != "POST":
+            raise _HttpError(405)
+        secret = headers.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+            raise _HttpError(403)
+        if not self.ready():
+            # Telegram retries non-2xx deliveries, so nothing is lost while starting.
+            raise _HttpError(503)
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise _HttpError(400) from None
+        # de_json maps JSON null to None, which must not reach the update queue.
+        if not isinstance(data, dict):
+            raise _HttpError(400)
+        try:
+            update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            raise _HttpError(400) from None
+        self.received += 1
+        await self.application.update_queue.put(update)
+        return 200, ""
+
+    @staticmethod
+    async def _respond(
+        writer: asyncio.StreamWriter, status: int, text: str = "", *, keep_alive: bool
+    ) -> None:
+        payload = text.encode()
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            "Content-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + payload)
+        await writer.drain()
+
+
+async def _serve_forever(application: Application) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    server = WebhookServer(application)
+    # Health answers while the bot initializes; readiness flips once it runs.
+    await server.start()
+    try:
+        async with application:
+            if application.post_init:
+                await application.post_init(application)
+            if WEBHOOK_URL:
+                await application.bot.set_webhook(
+                    url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                    secret_token=WEBHOOK_SECRET,
+                )
+                logger.info("Webhook registered at %s%s", WEBHOOK_URL, WEBHOOK_PATH)
+            await application.start()
+            await stop.wait()
+            logger.info("Stopping webhook server...")
+            await server.stop()
+            await application.stop()
+    finally:
+        await server.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run_webhook(application: Application) -> None:
+    """Blocking entry point, the webhook counterpart of ``run_polling``."""
+    asyncio.run(_serve_forever(application))